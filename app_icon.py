@@ -1,43 +1,575 @@
 
-import win32com.client
-import win32gui
-import win32ui
-import win32con
 from configparser import ConfigParser
-from PIL import Image, ImageFilter, ImageOps
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import argparse
+import contextlib
+import cProfile
+import ctypes
+import fnmatch
+import functools
+import hashlib
+import importlib.util
+import inspect
+import io
+import itertools
+import json
+import mmap
+import operator
 import os
-from PIL import Image, ImageFilter, ImageOps
-import os
-import numpy as np
-import cv2
+import queue
+import re
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
 
 
-def get_target_and_icon_from_lnk(lnk_path):
-    #target path and icon path from a .lnk file
+def lazy_import(name):
+    #the module is only loaded on first attribute access, so commands that never touch
+    #numpy, OpenCV or PIL (help, cache, listing sources) do not pay for importing them
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
+ImageFilter = lazy_import("PIL.ImageFilter")
+ImageOps = lazy_import("PIL.ImageOps")
+
+@functools.lru_cache(maxsize=None)
+def win32_modules():
+    #(win32gui, win32ui, win32con), None when pywin32 is missing (not on Windows)
+    #only the GDI fallback needs them, icons are otherwise read from the files directly
     try:
-        shell = win32com.client.Dispatch("WScript.Shell")
-        shortcut = shell.CreateShortCut(lnk_path)
-        target_path = shortcut.Targetpath
-        icon_path = shortcut.IconLocation.split(',')[0]
-        
-        #if icon path is not valid
-        if not icon_path or not os.path.exists(icon_path):
-            icon_path = target_path
-        
+        import win32gui
+        import win32ui
+        import win32con
+    except ImportError:
+        return None
+    return win32gui, win32ui, win32con
+
+
+#opt-in per-stage timing, see enable_instrumentation
+#while it is off every hook is a single None check
+_instrumentation = None
+_NO_STAGE = contextlib.nullcontext()
+
+def enable_instrumentation(trace_path=None, profile_dir=None, summary=False):
+    #records stage durations and variant pixel counts for every icon, with summary a short one is printed per icon
+    #trace_path gets one JSON line per icon, profile_dir one cProfile .prof file per icon
+    global _instrumentation
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    _instrumentation = {'trace_path': trace_path, 'profile_dir': profile_dir, 'summary': summary,
+                        'icon': None, 'records': []}
+
+def disable_instrumentation():
+    global _instrumentation
+    _instrumentation = None
+
+@contextlib.contextmanager
+def _timed_stage(name, group):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations = _instrumentation['icon'][group]
+        durations[name] = durations.get(name, 0.0) + time.perf_counter() - start
+
+def stage(name, group='stages'):
+    #times a block of work of the current icon, durations of repeated names add up
+    if _instrumentation is None or _instrumentation['icon'] is None:
+        return _NO_STAGE
+    return _timed_stage(name, group)
+
+def record_pixels(name, img):
+    #visible pixel count of a variant, only computed while instrumentation is on
+    if _instrumentation is not None and _instrumentation['icon'] is not None:
+        _instrumentation['icon']['pixels'][name] = int(np.count_nonzero(np.asarray(img)[:, :, 3]))
+
+def record_score(name, metrics):
+    #quality metrics of a ranked variant, only kept while instrumentation is on
+    if _instrumentation is not None and _instrumentation['icon'] is not None:
+        _instrumentation['icon']['scores'][name] = metrics
+
+@contextlib.contextmanager
+def trace_icon(base_name):
+    #collects the stages of one icon into a record, nested calls join the outer record
+    if _instrumentation is None or _instrumentation['icon'] is not None:
+        yield
+        return
+
+    record = {'icon': base_name, 'pid': os.getpid(), 'functions': {}, 'stages': {}, 'pixels': {}, 'scores': {}}
+    _instrumentation['icon'] = record
+    profiler = None
+    if _instrumentation['profile_dir']:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['total'] = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            safe_name = re.sub(r'[^\w.-]+', '_', base_name)
+            profiler.dump_stats(os.path.join(_instrumentation['profile_dir'], f"{safe_name}.prof"))
+        _instrumentation['icon'] = None
+        _instrumentation['records'].append(record)
+
+        if _instrumentation['summary']:
+            slowest = sorted(record['stages'].items(), key=lambda item: item[1], reverse=True)[:3]
+            print(f"Timings for {base_name}: {record['total']:.3f}s total, slowest "
+                  + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in slowest))
+
+def instrumented(fn):
+    #wraps fn in an icon record named after its base_name (or img_path) argument when instrumentation is on
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _instrumentation is None:
+            return fn(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs).arguments
+        name = arguments.get('base_name') or os.path.basename(str(arguments.get('img_path') or fn.__name__))
+        with trace_icon(name), stage(fn.__name__, 'functions'):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def drain_trace_records():
+    #finished icon records since the last call, used to hand worker records back to the main process
+    if _instrumentation is None:
+        return []
+    records, _instrumentation['records'] = _instrumentation['records'], []
+    return records
+
+def write_trace_records(records):
+    #appends records to the trace file as JSON lines
+    if records and _instrumentation is not None and _instrumentation['trace_path']:
+        with open(_instrumentation['trace_path'], 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+#Shell Link (.lnk) layout constants, see [MS-SHLLINK]
+LNK_CLSID = b'\x01\x14\x02\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00\x46'
+LNK_HAS_ID_LIST = 0x1
+LNK_HAS_LINK_INFO = 0x2
+LNK_STRING_FLAGS = (('name', 0x4), ('relative_path', 0x8), ('working_dir', 0x10),
+                    ('arguments', 0x20), ('icon_location', 0x40))
+LNK_IS_UNICODE = 0x80
+LNK_HAS_EXP_ICON = 0x4000
+LNK_ENVIRONMENT_BLOCK = 0xA0000001
+LNK_ICON_ENVIRONMENT_BLOCK = 0xA0000007
+ANSI_ENCODING = 'mbcs' if os.name == 'nt' else 'cp1252'
+
+def expand_windows_vars(path):
+    #expands %VAR% references, unknown variables are left untouched
+    return re.sub(r'%([^%]+)%', lambda m: os.environ.get(m.group(1), m.group(0)), path)
+
+def read_c_string(data, offset, unicode=False):
+    if unicode:
+        end = offset
+        while end + 1 < len(data) and data[end:end + 2] != b'\0\0':
+            end += 2
+        return data[offset:end].decode('utf-16-le', errors='replace')
+    end = data.find(b'\0', offset)
+    return data[offset:end if end != -1 else len(data)].decode(ANSI_ENCODING, errors='replace')
+
+def parse_lnk(lnk_path):
+    #reads a .lnk file without COM, returns (target_path, icon_location, icon_index)
+    with open(lnk_path, 'rb') as f:
+        data = f.read()
+    if len(data) < 0x4C or struct.unpack_from('<I', data, 0)[0] != 0x4C or data[4:20] != LNK_CLSID:
+        raise ValueError("not a shell link file")
+
+    flags = struct.unpack_from('<I', data, 0x14)[0]
+    icon_index = struct.unpack_from('<i', data, 0x38)[0]
+    pos = 0x4C
+    target_path = ''
+
+    if flags & LNK_HAS_ID_LIST:
+        pos += 2 + struct.unpack_from('<H', data, pos)[0]
+
+    if flags & LNK_HAS_LINK_INFO:
+        info = pos
+        info_size, header_size, info_flags, _, local_base, network_link, suffix = struct.unpack_from('<7I', data, info)
+        local_base_unicode = suffix_unicode = 0
+        if header_size >= 0x24:
+            local_base_unicode, suffix_unicode = struct.unpack_from('<II', data, info + 28)
+
+        if suffix_unicode:
+            path_suffix = read_c_string(data, info + suffix_unicode, unicode=True)
+        else:
+            path_suffix = read_c_string(data, info + suffix)
+
+        if info_flags & 0x1:  #local volume
+            if local_base_unicode:
+                target_path = read_c_string(data, info + local_base_unicode, unicode=True) + path_suffix
+            else:
+                target_path = read_c_string(data, info + local_base) + path_suffix
+        elif info_flags & 0x2:  #network share
+            link = info + network_link
+            net_name_offset = struct.unpack_from('<I', data, link + 8)[0]
+            if net_name_offset > 0x14:
+                net_name = read_c_string(data, link + struct.unpack_from('<I', data, link + 20)[0], unicode=True)
+            else:
+                net_name = read_c_string(data, link + net_name_offset)
+            target_path = net_name + ('\\' + path_suffix if path_suffix else '')
+        pos += info_size
+
+    strings = {}
+    for name, flag in LNK_STRING_FLAGS:
+        if flags & flag:
+            count = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+            if flags & LNK_IS_UNICODE:
+                strings[name] = data[pos:pos + count * 2].decode('utf-16-le', errors='replace')
+                pos += count * 2
+            else:
+                strings[name] = data[pos:pos + count].decode(ANSI_ENCODING, errors='replace')
+                pos += count
+
+    #extra data blocks, environment variable paths take precedence when present
+    environment_target = environment_icon = ''
+    while pos + 8 <= len(data):
+        block_size, signature = struct.unpack_from('<II', data, pos)
+        if block_size < 8:
+            break
+        if signature in (LNK_ENVIRONMENT_BLOCK, LNK_ICON_ENVIRONMENT_BLOCK) and block_size >= 0x314:
+            value = read_c_string(data, pos + 268, unicode=True) or read_c_string(data, pos + 8)
+            if signature == LNK_ENVIRONMENT_BLOCK:
+                environment_target = value
+            else:
+                environment_icon = value
+        pos += block_size
+
+    if not target_path and environment_target:
+        target_path = expand_windows_vars(environment_target)
+    if not target_path and strings.get('relative_path'):
+        target_path = os.path.normpath(os.path.join(os.path.dirname(lnk_path), strings['relative_path']))
+
+    icon_location = strings.get('icon_location', '')
+    if flags & LNK_HAS_EXP_ICON and environment_icon:
+        icon_location = environment_icon
+    return target_path, expand_windows_vars(icon_location), icon_index
+
+def parse_url_shortcut(url_path):
+    #reads an InternetShortcut (.url) file, returns (url, icon_file, icon_index)
+    config = ConfigParser(interpolation=None, strict=False)
+    try:
+        with open(url_path, 'r', encoding='utf-8-sig') as f:
+            config.read_file(f)
+    except UnicodeDecodeError:
+        with open(url_path, 'r', encoding=ANSI_ENCODING, errors='replace') as f:
+            config.read_file(f)
+
+    if not config.has_section('InternetShortcut'):
+        raise ValueError("not an internet shortcut")
+    section = config['InternetShortcut']
+    try:
+        icon_index = int(section.get('IconIndex', '0'))
+    except ValueError:
+        icon_index = 0
+    return section.get('URL', ''), expand_windows_vars(section.get('IconFile', '')), icon_index
+
+@functools.lru_cache(maxsize=1)
+def known_steam_libraries():
+    #find_steam_libraries once per process, every steam:// shortcut would probe all volumes again otherwise
+    #cleared when a watch rescan may have found new libraries
+    return tuple(find_steam_libraries())
+
+def find_steam_app_executable(appid, steam_libraries=None):
+    #main executable of an installed Steam game, used for steam://rungameid shortcuts without an icon
+    for library in steam_libraries if steam_libraries is not None else known_steam_libraries():
+        for manifest in read_app_manifests(library):
+            if manifest.get('appid') == str(appid):
+                game_dir = os.path.join(library, 'steamapps', 'common', manifest['installdir'])
+                if os.path.isdir(game_dir):
+                    names = (manifest.get('name', ''), manifest['installdir'])
+                    return pick_main_executable(game_dir, scan_executables(game_dir, {}, {}), names)
+    return None
+
+def resolve_shortcut(shortcut_path):
+    #(target, icon_path, icon_index) of a .lnk or .url shortcut, falls back to the target when the icon is missing
+    if shortcut_path.lower().endswith('.url'):
+        target, icon_path, icon_index = parse_url_shortcut(shortcut_path)
+        steam_game = re.match(r'steam://rungameid/(\d+)', target, re.IGNORECASE)
+        if (not icon_path or not os.path.exists(icon_path)) and steam_game:
+            target = find_steam_app_executable(steam_game.group(1)) or target
+            icon_path, icon_index = target, 0
+    else:
+        target, icon_location, icon_index = parse_lnk(shortcut_path)
+        icon_path = icon_location
+
+    #if icon path is not valid
+    if not icon_path or not os.path.exists(icon_path):
+        icon_path, icon_index = target, 0
+    return target, icon_path, icon_index
+
+def get_icon_location(shortcut_path):
+    #icon path and icon index from a .lnk or .url file, (None, 0) when there is no usable icon
+    try:
+        _, icon_path, icon_index = resolve_shortcut(shortcut_path)
         if icon_path and os.path.exists(icon_path):
             print(f"Extracted icon path: {icon_path}")
-            return icon_path
+            return icon_path, icon_index
         else:
-            print(f"No valid icon found in {lnk_path}")
+            print(f"No valid icon found in {shortcut_path}")
     except Exception as e:
-        print(f"Failed to extract target and icon from {lnk_path}: {e}")
-    return None
+        print(f"Failed to extract target and icon from {shortcut_path}: {e}")
+    return None, 0
+
+def get_target_and_icon_from_lnk(lnk_path):
+    #target path and icon path from a .lnk file
+    return get_icon_location(lnk_path)[0]
+
+RT_ICON = 3
+RT_GROUP_ICON = 14
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def pe_rva_to_offset(data, rva):
+    #maps a relative virtual address of a PE image to a file offset through the section table
+    pe_offset = struct.unpack_from('<I', data, 0x3C)[0]
+    num_sections, optional_size = struct.unpack_from('<H12xH', data, pe_offset + 6)
+    section_offset = pe_offset + 24 + optional_size
+    for i in range(num_sections):
+        virtual_size, virtual_address, raw_size, raw_pointer = struct.unpack_from(
+            '<IIII', data, section_offset + i * 40 + 8
+        )
+        if virtual_address <= rva < virtual_address + max(virtual_size, raw_size):
+            return rva - virtual_address + raw_pointer
+    raise ValueError(f"RVA {rva:#x} is outside every section")
+
+def read_pe_resources(data, resource_type):
+    #returns [(id_or_name, bytes)] for every resource of a type, first language only,
+    #in resource directory order (named entries first, then ids ascending) like Windows enumerates them
+    if data[:2] != b'MZ':
+        raise ValueError("not a PE file")
+    pe_offset = struct.unpack_from('<I', data, 0x3C)[0]
+    if data[pe_offset:pe_offset + 4] != b'PE\0\0':
+        raise ValueError("not a PE file")
+
+    optional_offset = pe_offset + 24
+    magic = struct.unpack_from('<H', data, optional_offset)[0]
+    if magic == 0x10B:  #PE32
+        count_offset, directories_offset = optional_offset + 92, optional_offset + 96
+    elif magic == 0x20B:  #PE32+
+        count_offset, directories_offset = optional_offset + 108, optional_offset + 112
+    else:
+        raise ValueError(f"unknown optional header magic {magic:#x}")
+
+    if struct.unpack_from('<I', data, count_offset)[0] <= 2:
+        return []
+    resource_rva, resource_size = struct.unpack_from('<II', data, directories_offset + 2 * 8)
+    if not resource_rva or not resource_size:
+        return []
+    base = pe_rva_to_offset(data, resource_rva)
+
+    def entries(offset):
+        #(id_or_name, is_directory, offset) of one IMAGE_RESOURCE_DIRECTORY
+        named, ids = struct.unpack_from('<HH', data, base + offset + 12)
+        result = []
+        for i in range(named + ids):
+            name, target = struct.unpack_from('<II', data, base + offset + 16 + i * 8)
+            if name & 0x80000000:
+                name_offset = base + (name & 0x7FFFFFFF)
+                length = struct.unpack_from('<H', data, name_offset)[0]
+                name = bytes(data[name_offset + 2:name_offset + 2 + length * 2]).decode('utf-16-le')
+            result.append((name, bool(target & 0x80000000), target & 0x7FFFFFFF))
+        return result
+
+    resources = []
+    for type_id, is_dir, type_offset in entries(0):
+        if type_id != resource_type or not is_dir:
+            continue
+        for name, is_dir, name_offset in entries(type_offset):
+            if not is_dir:
+                continue
+            languages = entries(name_offset)
+            if not languages or languages[0][1]:
+                continue
+            data_rva, size = struct.unpack_from('<II', data, base + languages[0][2])
+            offset = pe_rva_to_offset(data, data_rva)
+            resources.append((name, bytes(data[offset:offset + size])))
+    return resources
+
+def read_icon_entries(icon_path, index=0):
+    #returns [(width, height, bit_count, data)] for every image of one icon in an .exe, .dll or .ico file
+    #index follows ExtractIconEx: n >= 0 is the n-th icon group, a negative n is the group with resource id -n
+    with open(icon_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] == b'\0\0\1\0':
+                #plain .ico file, entries point straight at the image data
+                count = struct.unpack_from('<H', data, 4)[0]
+                result = []
+                for i in range(count):
+                    width, height, _, _, _, bit_count, size, offset = struct.unpack_from(
+                        '<BBBBHHII', data, 6 + i * 16
+                    )
+                    result.append((width or 256, height or 256, bit_count, bytes(data[offset:offset + size])))
+                return result
+
+            groups = read_pe_resources(data, RT_GROUP_ICON)
+            if index < 0:
+                groups = [g for g in groups if g[0] == -index]
+                index = 0
+            if index >= len(groups):
+                return []
+
+            icons = dict(read_pe_resources(data, RT_ICON))
+            group = groups[index][1]
+            count = struct.unpack_from('<H', group, 4)[0]
+            result = []
+            for i in range(count):
+                width, height, _, _, _, bit_count, _, icon_id = struct.unpack_from(
+                    '<BBBBHHIH', group, 6 + i * 14
+                )
+                if icon_id in icons:
+                    result.append((width or 256, height or 256, bit_count, icons[icon_id]))
+            return result
+
+def decode_icon_entry(width, height, bit_count, data):
+    #decodes one icon image (PNG or BMP/DIB with its AND mask) to an RGBA Image
+    if data.startswith(PNG_SIGNATURE):
+        img = Image.open(io.BytesIO(data))
+    else:
+        #wrap the DIB in a one-image .ico so PIL applies the AND mask for us
+        header = struct.pack('<HHH', 0, 1, 1) + struct.pack(
+            '<BBBBHHII', width % 256, height % 256, 0, 0, 1, bit_count, len(data), 22
+        )
+        img = Image.open(io.BytesIO(header + data))
+    img.load()
+    return img.convert("RGBA")
+
+#plain images that are processed as they are, as a single size icon
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.gif', '.jpg', '.jpeg', '.webp')
+
+def extract_icons(icon_path, index=0):
+    """Extracts every embedded size of one icon, largest first, as a list of Image objects."""
+    if icon_path.lower().endswith(IMAGE_EXTENSIONS):
+        with Image.open(icon_path) as img:
+            return [img.convert("RGBA")]
+    #only the deepest colour image of each size is kept
+    best = {}
+    for entry in read_icon_entries(icon_path, index):
+        size = (entry[0], entry[1])
+        if size not in best or entry[2] > best[size][2]:
+            best[size] = entry
+    images = [decode_icon_entry(*entry) for entry in best.values()]
+    return sorted(images, key=lambda img: img.size[0] * img.size[1], reverse=True)
+
+def extract_icon_images(icon_path, index=0, store_dir=None):
+    #every embedded size of an icon largest first, [] when nothing could be extracted
+    #results are remembered for the run by file identity (path, size, mtime, index), and kept
+    #between runs in store_dir when given, so a file shared by several shortcuts is read once
+    try:
+        st = os.stat(icon_path)
+    except OSError:
+        return extract_icon_images_uncached(icon_path, index)
+    path = os.path.normcase(os.path.abspath(icon_path))
+    images = _memo_icon_images(path, index, st.st_size, st.st_mtime_ns, store_dir)
+    #callers are free to modify what they get
+    return [img.copy() for img in images]
+
+#number of extracted icons remembered per process
+EXTRACTION_MEMO_SIZE = 64
+#bump when extraction changes, stored extractions from older versions are then ignored
+EXTRACTION_VERSION = 1
+
+@functools.lru_cache(maxsize=EXTRACTION_MEMO_SIZE)
+def _memo_icon_images(path, index, file_size, mtime_ns, store_dir):
+    identity = (EXTRACTION_VERSION, path, index, file_size, mtime_ns)
+    images = load_extracted_icon(store_dir, identity) if store_dir else None
+    if images is None:
+        images = extract_icon_images_uncached(path, index)
+        if images and store_dir:
+            store_extracted_icon(store_dir, identity, images)
+    return tuple(images)
 
-def extract_icon(icon_path):
+def extracted_icon_path(store_dir, identity):
+    #stored extractions sit next to the processed entries (folders) and are evicted with them
+    return os.path.join(store_dir, "x-" + hashlib.sha256(repr(identity).encode()).hexdigest())
+
+def load_extracted_icon(store_dir, identity):
+    #the stored images for identity, None when there are none
+    #layout: image count, (width, height) of each image, then their raw RGBA bytes
+    path = extracted_icon_path(store_dir, identity)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)  #mark as recently used for eviction
+        count, = struct.unpack_from('<H', data)
+        offset = 2 + 4 * count
+        images = []
+        for i in range(count):
+            width, height = struct.unpack_from('<HH', data, 2 + 4 * i)
+            end = offset + width * height * 4
+            images.append(Image.frombytes('RGBA', (width, height), data[offset:end]))
+            offset = end
+        return images
+    except (OSError, struct.error, ValueError):
+        return None
+
+def store_extracted_icon(store_dir, identity, images):
+    images = [img.convert('RGBA') for img in images]
+    data = struct.pack('<H', len(images))
+    data += b''.join(struct.pack('<HH', *img.size) for img in images)
+    data += b''.join(img.tobytes() for img in images)
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        write_atomic(extracted_icon_path(store_dir, identity), data)
+    except OSError as e:
+        print(f"Failed to store extracted icon: {e}")
+
+def extract_icon_images_uncached(icon_path, index=0):
+    #GDI rendering is only a fallback on Windows
+    try:
+        images = extract_icons(icon_path, index)
+        if images:
+            return images
+        message = f"No icons found in {icon_path}"
+    except Exception as e:
+        message = f"Failed to extract icon from {icon_path}: {e}"
+
+    if win32_modules() is not None:
+        img = extract_icon_gdi(icon_path, index)
+        return [img] if img else []
+    print(message)
+    return []
+
+def extract_icon(icon_path, index=0, size=None):
     """Extracts an icon from an .exe, .ico, or .dll file and returns it as an Image object."""
+    #the largest embedded image at its native size, unless a size is asked for
+    images = extract_icon_images(icon_path, index)
+    if not images:
+        return None
+    img = images[0]
+    if size and img.size != (size, size):
+        img = img.resize((size, size), Image.LANCZOS)
+    return img
+
+def extract_icon_gdi(icon_path, index=0, size=256):
+    #renders the icon through win32 ExtractIconEx/DrawIconEx, Windows only
+    #every icon, DC and bitmap handle is released before returning, also when drawing fails
+    win32gui, win32ui, win32con = win32_modules()
+    large, small = [], []
+    screen_dc = hdc_mem = bmp = old_bitmap = None
     try:
         #icons from the file
-        large, small = win32gui.ExtractIconEx(icon_path, 0)
+        large, small = win32gui.ExtractIconEx(icon_path, index)
         if not large and not small:
             print(f"No icons found in {icon_path}")
             return None
@@ -45,14 +577,15 @@ def extract_icon(icon_path):
         hicon = large[0] if large else small[0]
         
         #set up device context
-        hdc = win32ui.CreateDCFromHandle(win32gui.GetDC(0))
+        screen_dc = win32gui.GetDC(0)
+        hdc = win32ui.CreateDCFromHandle(screen_dc)
         hdc_mem = hdc.CreateCompatibleDC()
         bmp = win32ui.CreateBitmap()
-        bmp.CreateCompatibleBitmap(hdc, 256, 256)
-        hdc_mem.SelectObject(bmp)
+        bmp.CreateCompatibleBitmap(hdc, size, size)
+        old_bitmap = hdc_mem.SelectObject(bmp)
         
         #draw the icon into the bitmap
-        win32gui.DrawIconEx(hdc_mem.GetSafeHdc(), 0, 0, hicon, 256, 256, 0, None, win32con.DI_NORMAL)
+        win32gui.DrawIconEx(hdc_mem.GetSafeHdc(), 0, 0, hicon, size, size, 0, None, win32con.DI_NORMAL)
         
         #convert to an image
         bmpinfo = bmp.GetInfo()
@@ -66,9 +599,65 @@ def extract_icon(icon_path):
         return img  #retuurn the directly for further processing
     except Exception as e:
         print(f"Failed to extract icon from {icon_path}: {e}")
+    finally:
+        release_gdi_handles(large, small, screen_dc, hdc_mem, bmp, old_bitmap)
     return None
 
-def enhanced_remove_artifacts(image, min_cluster_size=5):
+def release_gdi_handles(icons, more_icons, screen_dc, hdc_mem, bmp, old_bitmap=None):
+    #each release is attempted on its own so one failure does not leak the rest
+    #GDI refuses to delete a bitmap that is still selected into a DC, so the memory DC gets its
+    #original bitmap back and is deleted before the bitmap is
+    win32gui = win32_modules()[0]
+    with contextlib.suppress(Exception):
+        if hdc_mem is not None and old_bitmap is not None:
+            hdc_mem.SelectObject(old_bitmap)
+    with contextlib.suppress(Exception):
+        if hdc_mem is not None:
+            hdc_mem.DeleteDC()
+    with contextlib.suppress(Exception):
+        if bmp is not None:
+            win32gui.DeleteObject(bmp.GetHandle())
+    with contextlib.suppress(Exception):
+        if screen_dc is not None:
+            win32gui.ReleaseDC(0, screen_dc)
+    for hicon in list(icons) + list(more_icons):
+        with contextlib.suppress(Exception):
+            win32gui.DestroyIcon(hicon)
+
+def label_clusters(image, connectivity=8):
+    #labels connected clusters of visible pixels, returns (labels, areas) with label 0 as background
+    alpha = np.asarray(image.convert("RGBA"))[:, :, 3]
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(
+        (alpha > 0).astype(np.uint8), connectivity=connectivity
+    )
+    return labels, stats[:count, cv2.CC_STAT_AREA]
+
+def cluster_area_histogram(image, connectivity=8):
+    #maps cluster area -> number of clusters with that area
+    _, areas = label_clusters(image, connectivity)
+    sizes, counts = np.unique(areas[1:], return_counts=True)
+    return dict(zip(sizes.tolist(), counts.tolist()))
+
+def enhanced_remove_artifacts(image, min_cluster_size=5, connectivity=8, debug=False):
+    #removes clusters of visible pixels smaller than min_cluster_size in one pass
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8")
+
+    labels, areas = label_clusters(image, connectivity)
+    small = areas < min_cluster_size
+    small[0] = False  #background
+
+    if debug:
+        histogram = cluster_area_histogram(image, connectivity)
+        histogram = ", ".join(f"{size}px x{count}" for size, count in histogram.items())
+        print(f"Cluster areas: {histogram or 'none'} (removing {int(small.sum())} below {min_cluster_size}px)")
+
+    cleaned = np.array(image.convert("RGBA"))
+    cleaned[small[labels]] = (255, 255, 255, 0)
+    return Image.fromarray(cleaned, "RGBA")
+
+def enhanced_remove_artifacts_reference(image, min_cluster_size=5):
+    #original flood fill implementation, kept to check enhanced_remove_artifacts against
     width, height = image.size
     cleaned = image.copy()
     visited = set()
@@ -107,7 +696,32 @@ def enhanced_remove_artifacts(image, min_cluster_size=5):
     
     return cleaned
 
+def isolated_white_pixels(pixels):
+    #opaque white pixels without an opaque white 8-neighbour, for an (H, W, 4) array or a stack of them (N, H, W, 4)
+    white = (pixels[..., 3] > 0) & (pixels[..., 0] == 255) & (pixels[..., 1] == 255) & (pixels[..., 2] == 255)
+    padded = np.pad(white, [(0, 0)] * (white.ndim - 2) + [(1, 1), (1, 1)]).astype(np.uint8)
+    height, width = white.shape[-2:]
+    neighbours = np.zeros(white.shape, dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            if (dy, dx) != (1, 1):
+                neighbours += padded[..., dy:dy + height, dx:dx + width]
+    return white & (neighbours == 0)
+
+def remove_artifacts_batch(pixels):
+    #remove_artifacts for a stack of same-sized RGBA arrays (N, H, W, 4), returns a new stack
+    cleaned = pixels.copy()
+    cleaned[isolated_white_pixels(pixels)] = (255, 255, 255, 0)
+    return np.stack([np.asarray(Image.fromarray(c, "RGBA").filter(ImageFilter.SMOOTH_MORE)) for c in cleaned])
+
 def remove_artifacts(image):
+    #clears opaque white pixels that have no opaque white neighbour, then smooths
+    pixels = np.array(image)
+    pixels[isolated_white_pixels(pixels)] = (255, 255, 255, 0)
+    return Image.fromarray(pixels, image.mode).filter(ImageFilter.SMOOTH_MORE)
+
+def remove_artifacts_reference(image):
+    #original per-pixel implementation, kept to check remove_artifacts against
     width, height = image.size
     cleaned = image.copy()
     
@@ -207,22 +821,42 @@ def extract_edges_and_fill(image):
     
     return Image.fromarray(result)
 
-def create_transparency_from_edges(image):
-    img_array = np.array(image)
-    
-    if len(img_array.shape) == 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+#blur and adaptive threshold parameters shared by the line/contour variants
+EdgePreprocessConfig = namedtuple(
+    'EdgePreprocessConfig', ['blur_ksize', 'blur_sigma', 'block_size', 'c'],
+    defaults=[(3, 3), 0.5, 11, 2]
+)
+EDGE_PREPROCESS = EdgePreprocessConfig()
+TRANSPARENCY_PREPROCESS = EdgePreprocessConfig(blur_ksize=(5, 5), blur_sigma=0)
+
+def preprocess_edges(image, config=EDGE_PREPROCESS, base=None):
+    #computes the array, grayscale, blurred and threshold planes once per icon
+    #base reuses the array and grayscale planes of an earlier call with another config
+    if base is not None:
+        img_array, gray = base['img_array'], base['gray']
     else:
-        gray = img_array
-    
-    #Gaussian blur
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    #apply adaptive thresholding
+        img_array = np.array(image)
+        if len(img_array.shape) == 3:
+            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = img_array
+
+    blurred = cv2.GaussianBlur(gray, config.blur_ksize, config.blur_sigma)
     thresh = cv2.adaptiveThreshold(
         blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY_INV, 11, 2
+        cv2.THRESH_BINARY_INV, config.block_size, config.c
     )
+    return {'config': config, 'img_array': img_array, 'gray': gray, 'blurred': blurred, 'thresh': thresh}
+
+def edge_planes(image, planes=None, config=EDGE_PREPROCESS):
+    #planes for config, reusing whatever was already computed for this image
+    if planes is not None and planes['config'] == config:
+        return planes
+    return preprocess_edges(image, config, base=planes)
+
+def create_transparency_from_edges(image, planes=None):
+    planes = edge_planes(image, planes, TRANSPARENCY_PREPROCESS)
+    img_array, gray, thresh = planes['img_array'], planes['gray'], planes['thresh']
     
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
@@ -240,20 +874,9 @@ def create_transparency_from_edges(image):
     
     return Image.fromarray(result)
 
-def form_coherent_lines(image):
-    img_array = np.array(image)
-
-    if len(img_array.shape) == 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img_array
-    
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0.5)
-
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY_INV, 11, 2
-    )
+def form_coherent_lines(image, planes=None):
+    planes = edge_planes(image, planes)
+    img_array, thresh = planes['img_array'], planes['thresh']
     
     #morphological operations
     kernel = np.ones((5,5), np.uint8)  #slightly smaller kernel for better detail
@@ -277,45 +900,295 @@ def form_coherent_lines(image):
     
     return Image.fromarray(result)
 
-def process_icon_with_edges(img, base_name, output_folder):
+#sizes written to every .ico, larger than the image are skipped
+ICO_SIZES = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
+#an .ico directory entry cannot describe anything larger
+ICO_MAX_SIZE = 256
+
+def encode_ico(images, sizes=None):
+    #builds a multi-size .ico in memory with a PNG entry per size: ICO_SIZES plus the extra sizes
+    #(the ones the source icon embeds), up to the size of the first image
+    #an image of exactly that size is used when given, every other size is downscaled once from the first image
+    #to fit the size while keeping its aspect ratio, like PIL's own ICO writer
+    if isinstance(images, Image.Image):
+        images = [images]
+    largest = images[0]
+    by_size = {img.size: img for img in reversed(images)}
+    width, height = min(largest.size[0], ICO_MAX_SIZE), min(largest.size[1], ICO_MAX_SIZE)
+    sizes = set(ICO_SIZES) | set(sizes or ())
+    sizes = sorted((s for s in sizes if s[0] <= width and s[1] <= height), reverse=True) or [largest.size]
+
+    entries = {}
+    for size in sizes:
+        frame = by_size.get(size)
+        if frame is None:
+            scale = min(size[0] / largest.size[0], size[1] / largest.size[1])
+            fitted = (max(round(largest.size[0] * scale), 1), max(round(largest.size[1] * scale), 1))
+            if fitted in entries:
+                continue
+            frame = by_size.get(fitted) or largest.resize(fitted, Image.LANCZOS)
+        buffer = io.BytesIO()
+        frame.convert("RGBA").save(buffer, format='PNG')
+        entries[frame.size] = buffer.getvalue()
+    entries = list(entries.items())
+
+    header = struct.pack('<HHH', 0, 1, len(entries))
+    offset = len(header) + 16 * len(entries)
+    directory = b''
+    for (width, height), data in entries:
+        directory += struct.pack('<BBBBHHII', width % 256, height % 256, 0, 0, 1, 32, len(data), offset)
+        offset += len(data)
+    return header + directory + b''.join(data for _, data in entries)
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+#read once at start up, os.umask can only be read by changing it, which is not thread safe
+UMASK = _umask()
+
+def publish_file(temp_path, path):
+    #moves a finished temporary file over path, mkstemp files are private (0600) so they first get
+    #the mode of the file they replace, or the one a plain open() would have given them
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o666 & ~UMASK
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+def write_atomic(path, data):
+    #writes through a temporary file in the same folder so readers never see half a file
+    handle, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        publish_file(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+_encoder_pool = None
+
+def ico_encoder_pool():
+    #shared threads for PNG encoding, PIL releases the GIL while compressing
+    global _encoder_pool
+    if _encoder_pool is None:
+        _encoder_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                                           thread_name_prefix="ico-encoder")
+    return _encoder_pool
+
+def _forget_encoder_pool():
+    #a forked worker inherits the pool object but not its threads
+    global _encoder_pool
+    _encoder_pool = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_encoder_pool)
+
+class IcoWriter:
+    #collects the .ico files of an icon, encodes them off the main thread and writes them in order
+    #at most max_pending files wait for their encoder, past that the oldest is written right away
+    #so the images of finished variants are released while the icon is still being processed
+    #with collect=True nothing touches the disk, written files pile up in files (name -> bytes) for a bundle
+
+    def __init__(self, collect=False, max_pending=8):
+        self.collect = collect
+        self.max_pending = max_pending
+        self.files = {}
+        self.pending = deque()
+        self.written = {}
+
+    def add(self, path, images, sizes=None):
+        self._queue(path, ico_encoder_pool().submit(encode_ico, images, sizes))
+
+    def add_bytes(self, path, data):
+        self._queue(path, data)
+
+    def _queue(self, path, data):
+        self.pending.append((path, data))
+        while len(self.pending) > self.max_pending:
+            self._write(*self.pending.popleft())
+
+    def _write(self, path, data):
+        if isinstance(data, Future):
+            data = data.result()
+        if self.collect:
+            self.files[os.path.basename(path)] = data
+        else:
+            write_atomic(path, data)
+        self.written[path] = data
+
+    def flush(self):
+        #waits for the encoders and writes what is left, returns {path: bytes} of everything since the last flush
+        while self.pending:
+            self._write(*self.pending.popleft())
+        written, self.written = self.written, {}
+        return written
+
+#a variant overlapping the solid part of the source this much is a copy of its silhouette
+SILHOUETTE_IOU = 0.97
+#score factor of such copies, they are the fallback when no variant shows any of the inside
+SILHOUETTE_PENALTY = 0.5
+#below this share of inner edges the source is a plain shape and its outline is all there is to match
+MIN_INNER_EDGES = 0.05
+
+def ranking_planes(source):
+    #what every variant of source is scored against: its silhouette and its edges, split into the
+    #edges along the rim of the silhouette and the inner ones (the detail a good variant shows)
+    src = np.asarray(source.convert("RGBA"))
+    silhouette = src[:, :, 3] > 0
+    gray = cv2.cvtColor(np.ascontiguousarray(src[:, :, :3]), cv2.COLOR_RGB2GRAY)
+    gray[~silhouette] = 0
+    edges = (cv2.Canny(gray, 50, 150) | cv2.Canny(src[:, :, 3], 50, 150)) > 0
+    kernel = np.ones((3, 3), np.uint8)
+    #an outline one pixel off a source edge still follows it
+    near_edges = cv2.dilate(edges.astype(np.uint8), kernel) > 0
+    rim = silhouette & ~cv2.erode(silhouette.astype(np.uint8), kernel).astype(bool)
+    inner_edges = edges & ~(cv2.dilate(rim.astype(np.uint8), kernel, iterations=2) > 0)
+    return {'silhouette': silhouette, 'solid': src[:, :, 3] >= 128, 'area': max(int(silhouette.sum()), 1),
+            'edge_pixels': int(edges.sum()), 'near_edges': near_edges,
+            'inner_edges': inner_edges, 'inner_pixels': int(inner_edges.sum())}
+
+def score_variant(variant, planes):
+    #cheap quality metrics of a finished variant, planes come from ranking_planes of its source
+    #score is in [0, 1]: overlap with the source silhouette, how well the variant's outline matches
+    #the source edges (follows them and recovers the inner ones, which a bare silhouette has none of)
+    #and how few separate pieces it has, scaled down for (nearly) empty variants and copies of the silhouette
+    mask = np.asarray(variant.convert("RGBA"))[:, :, 3] >= 128  #antialiasing blurs the outline
+    silhouette = planes['silhouette']
+
+    coverage = int(mask.sum()) / planes['area']
+    union = int((mask | silhouette).sum())
+    iou = int((mask & silhouette).sum()) / union if union else 0.0
+
+    count, _ = cv2.connectedComponents(mask.astype(np.uint8), connectivity=8)
+    components = count - 1
+
+    kernel = np.ones((3, 3), np.uint8)
+    outline = mask & ~cv2.erode(mask.astype(np.uint8), kernel).astype(bool)
+    outline_pixels = int(outline.sum())
+    follows = int((outline & planes['near_edges']).sum()) / outline_pixels if outline_pixels else 0.0
+    if planes['inner_pixels'] and planes['inner_pixels'] >= MIN_INNER_EDGES * planes['edge_pixels']:
+        near_outline = cv2.dilate(outline.astype(np.uint8), kernel).astype(bool)
+        detail = int((near_outline & planes['inner_edges']).sum()) / planes['inner_pixels']
+    else:
+        detail = 1.0 if outline_pixels else 0.0
+    coherence = 2 * follows * detail / (follows + detail) if follows + detail else 0.0
+
+    solid = planes['solid']
+    solid_union = int((mask | solid).sum())
+    plain = solid_union > 0 and int((mask & solid).sum()) / solid_union >= SILHOUETTE_IOU
+
+    fill = min(coverage / 0.15, 1.0)
+    clean = 1 / (1 + max(components - 1, 0) / 4)
+    score = fill * (0.2 * iou + 0.5 * coherence + 0.3 * clean) * (SILHOUETTE_PENALTY if plain else 1.0)
+    return {'score': score, 'coverage': coverage, 'components': components, 'coherence': coherence, 'iou': iou,
+            'detail': detail, 'silhouette': plain}
+
+class RankingWriter:
+    #stands in for an IcoWriter and only passes on the top_k best scoring variants when finished,
+    #the others are never encoded
+    #with min_score, done turns True once top_k variants reached it so the caller can stop making more,
+    #top_k then defaults to 1
+
+    def __init__(self, writer, source, top_k=None, min_score=None):
+        self.writer = writer
+        self.planes = ranking_planes(source)
+        self.top_k = top_k or (1 if min_score is not None else None)
+        self.min_score = min_score
+        self.best = []
+        self.scored = 0
+        self.seen = set()
+
+    @property
+    def done(self):
+        return (self.min_score is not None and len(self.best) == self.top_k
+                and self.best[-1][0] >= self.min_score)
+
+    def add(self, path, images, sizes=None):
+        image = images if isinstance(images, Image.Image) else images[0]
+        #a variant identical to an earlier one (e.g. nothing to drop for white_no_black) would take a
+        #second place with the same score, it is left out
+        digest = hashlib.sha256(image.convert("RGBA").tobytes()).digest()
+        if digest in self.seen:
+            return
+        self.seen.add(digest)
+        with stage("score"):
+            metrics = score_variant(image, self.planes)
+        record_score(os.path.basename(path), metrics)
+        self.scored += 1
+        #only the current top_k are held, a tie keeps the variant made first
+        self.best.append((metrics['score'], self.scored, path, images, sizes))
+        self.best.sort(key=lambda entry: (-entry[0], entry[1]))
+        if self.top_k is not None:
+            del self.best[self.top_k:]
+
+    def finish(self):
+        #hands the kept variants to the real writer, returns {path: score} of them in score order
+        kept = {}
+        for score, _, path, images, sizes in self.best:
+            self.writer.add(path, images, sizes)
+            kept[path] = score
+        self.best = []
+        return kept
+
+@instrumented
+def process_icon_with_edges(img, base_name, output_folder, sizes=None, writer=None,
+                            variants=("white_thick", "white_curved")):
+    #variants picks which of the thick and curved versions are made
+    #with a writer the files are only queued on it, the caller flushes
+    own_writer = writer is None
+    writer = writer or IcoWriter()
     try:
         img = img.convert("RGBA")
-        
-        #thick version (previous implementation)
-        thick_version = form_coherent_lines_thick(img)
-        thick_version = enhanced_remove_artifacts(thick_version)
-        thick_version = apply_antialiasing(thick_version)
-        
-        #curved version (new implementation)
-        curved_version = form_coherent_lines_curved(img)
-        curved_version = enhanced_remove_artifacts(curved_version)
-        curved_version = apply_antialiasing(curved_version)
-        
-        #save both variations
-        thick_path = os.path.join(output_folder, f"{base_name}_white_thick.ico")
-        curved_path = os.path.join(output_folder, f"{base_name}_white_curved.ico")
-        
-        thick_version.save(thick_path, format='ICO')
-        curved_version.save(curved_path, format='ICO')
-        
-        print(f"Saved both versions: {thick_path}, {curved_path}")
+
+        #gray, blur and threshold are shared by both versions
+        with stage("edges.preprocess"):
+            planes = preprocess_edges(img)
+
+        #thick is the previous implementation, curved the new one
+        line_functions = [("white_thick", form_coherent_lines_thick), ("white_curved", form_coherent_lines_curved)]
+        versions = []
+        for suffix, form_lines in line_functions:
+            if suffix not in variants:
+                continue
+            with stage(f"lines.{suffix}"):
+                version = form_lines(img, planes)
+            with stage(f"artifacts.{suffix}"):
+                version = enhanced_remove_artifacts(version)
+            record_pixels(suffix, version)
+            with stage(f"antialias.{suffix}"):
+                version = apply_antialiasing(version)
+            versions.append((os.path.join(output_folder, f"{base_name}_{suffix}.ico"), version))
+
+        #save the variations
+        for path, version in versions:
+            writer.add(path, version, sizes)
+        if own_writer:
+            with stage("encode.flush"):
+                writer.flush()
+
+        paths = [path for path, _ in versions]
+        if isinstance(writer, RankingWriter):
+            pass  #only the kept versions are reported, by process_icon_stack
+        elif len(paths) == 2:
+            print(f"Saved both versions: {paths[0]}, {paths[1]}")
+        else:
+            for path in paths:
+                print(f"Saved version: {path}")
+        return paths
         
     except Exception as e:
         print(f"Failed to process versions for {base_name}: {e}")
+    return None
 
-def form_coherent_lines_thick(image):
+def form_coherent_lines_thick(image, planes=None):
     #previous implementation with 7x7 kernel
-    img_array = np.array(image)
-    if len(img_array.shape) == 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img_array
-    
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0.5)
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY_INV, 11, 2
-    )
+    planes = edge_planes(image, planes)
+    img_array, thresh = planes['img_array'], planes['thresh']
     
     kernel = np.ones((7,7), np.uint8)
     cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
@@ -327,19 +1200,10 @@ def form_coherent_lines_thick(image):
     
     return Image.fromarray(result)
 
-def form_coherent_lines_curved(image):
+def form_coherent_lines_curved(image, planes=None):
     #new implementation with contour smoothing
-    img_array = np.array(image)
-    if len(img_array.shape) == 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img_array
-    
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0.5)
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY_INV, 11, 2
-    )
+    planes = edge_planes(image, planes)
+    img_array, thresh = planes['img_array'], planes['thresh']
     
     kernel = np.ones((5,5), np.uint8)
     cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
@@ -358,44 +1222,239 @@ def form_coherent_lines_curved(image):
     
     return Image.fromarray(result)
 
-def process_icon(img, base_name, output_folder):
-    try:
-        img = img.convert("RGBA")
-        width, height = img.size
-
-        def process_variation(condition_fn, filename_suffix):
-            img_variant = Image.new("RGBA", img.size, (255, 255, 255, 0))
-            for y in range(height):
-                for x in range(width):
-                    r, g, b, a = img.getpixel((x, y))
-                    if a > 0 and condition_fn(r, g, b):
-                        img_variant.putpixel((x, y), (255, 255, 255, a))
-            img_variant = enhanced_remove_artifacts(img_variant)
-            img_variant = apply_antialiasing(img_variant)
-            output_path = os.path.join(output_folder, f"{base_name}_{filename_suffix}.ico")
-            img_variant.save(output_path, format='ICO')
-            print(f"Saved {filename_suffix} version: {output_path}")
-
-        #standard variations
-        process_variation(lambda r, g, b: (r + g + b) / 3 < 128, "white")
-        process_variation(lambda r, g, b: (r + g + b) / 3 >= 128, "white_alt")
-        process_variation(lambda r, g, b: True, "white_original")
-        process_variation(lambda r, g, b: (r + g + b) / 3 > 30, "white_no_black")
-        process_variation(lambda r, g, b: (r + g + b) / 3 < 225, "white_no_white")
-        process_variation(lambda r, g, b: (r + g + b) / 3 >= 225, "white_only")
-        process_variation(lambda r, g, b: (r + g + b) / 3 <= 60 or 60 < (r + g + b) / 3 < 130 or ((r + g + b) / 3 >= 200 and r > 200 and g > 200 and b > 200), "white_pix")
-        
-        #edge and line detection processing
-        process_icon_with_edges(img, base_name, output_folder)
-        
-        #characteristic variations
-        create_characteristic_variations(img_path=None, output_folder=output_folder, img=img, base_name=base_name)
+#threshold variations, one entry per output file
+#a pixel is kept when it is visible and matches ANY of the clauses,
+#a clause matches when ALL of its (plane, op, value) terms hold
+#an empty clause always matches, planes are r, g, b and brightness ((r + g + b) / 3)
+THRESHOLD_VARIATIONS = [
+    ("white", [[("brightness", "<", 128)]]),
+    ("white_alt", [[("brightness", ">=", 128)]]),
+    ("white_original", [[]]),
+    ("white_no_black", [[("brightness", ">", 30)]]),
+    ("white_no_white", [[("brightness", "<", 225)]]),
+    ("white_only", [[("brightness", ">=", 225)]]),
+    ("white_pix", [
+        [("brightness", "<=", 60)],
+        [("brightness", ">", 60), ("brightness", "<", 130)],
+        [("brightness", ">=", 200), ("r", ">", 200), ("g", ">", 200), ("b", ">", 200)],
+    ]),
+]
 
-    except Exception as e:
-        print(f"Failed to process icon for {base_name}: {e}")
+THRESHOLD_OPS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+def threshold_mask(planes, clauses):
+    #builds the boolean mask for one variation from the shared planes
+    mask = np.zeros(planes["alpha"].shape, dtype=bool)
+    for clause in clauses:
+        clause_mask = np.ones(planes["alpha"].shape, dtype=bool)
+        for plane, op, value in clause:
+            clause_mask &= THRESHOLD_OPS[op](planes[plane], value)
+        mask |= clause_mask
+    return mask & (planes["alpha"] > 0)
+
+def threshold_variations_batch(pixels, variations=THRESHOLD_VARIATIONS):
+    #yields (suffix, stack) for every threshold variation of a stack of RGBA arrays (N, H, W, 4)
+    #the planes are computed once for the whole stack and shared by all variations,
+    #brightness only when one of the variations looks at it
+    used = {plane for _, clauses in variations for clause in clauses for plane, _, _ in clause}
+    with stage("threshold.planes"):
+        planes = {
+            "r": pixels[..., 0],
+            "g": pixels[..., 1],
+            "b": pixels[..., 2],
+            "alpha": pixels[..., 3],
+        }
+        if "brightness" in used:
+            rgb = pixels[..., :3].astype(np.uint16)
+            #same float64 division as (r + g + b) / 3 in python, so comparisons match exactly
+            planes["brightness"] = rgb.sum(axis=-1) / 3
+
+    for suffix, clauses in variations:
+        with stage(f"mask.{suffix}"):
+            mask = threshold_mask(planes, clauses)
+            result = np.full(pixels.shape, 255, dtype=np.uint8)
+            result[..., 3] = np.where(mask, planes["alpha"], 0)
+        yield suffix, result
+
+def render_threshold_variations(img, variations=THRESHOLD_VARIATIONS):
+    #yields (suffix, image) for every threshold variation of one image
+    pixels = np.asarray(img.convert("RGBA"))[np.newaxis]
+    for suffix, result in threshold_variations_batch(pixels, variations):
+        yield suffix, Image.fromarray(result[0], "RGBA")
+
+#every variant process_icon can make, in output order, with the planes it is computed from:
+#threshold variations share the RGBA planes, thick and curved share the edge preprocessing,
+#characteristic makes two files named after the dominant characteristic (_light/_dark...)
+VARIANTS = {
+    **{suffix: "threshold" for suffix, _ in THRESHOLD_VARIATIONS},
+    "white_thick": "edges",
+    "white_curved": "edges",
+    "characteristic": "characteristic",
+}
+
+#file suffixes of the characteristic pair, by dominant characteristic
+CHARACTERISTIC_SUFFIXES = {
+    'brightness': ('_light', '_dark'),
+    'saturation': ('_saturated', '_muted'),
+    'temperature': ('_warm', '_cool'),
+}
+
+def parse_variants(text):
+    #comma separated variant names to a tuple in registry order, None when text is empty or "all"
+    #the white_ prefix may be left out, "curved" selects white_curved
+    names = [name.strip().lower() for name in (text or "").split(",") if name.strip()]
+    if not names or names == ["all"]:
+        return None
+    selected = set()
+    for name in names:
+        if name not in VARIANTS and f"white_{name}" in VARIANTS:
+            name = f"white_{name}"
+        if name not in VARIANTS:
+            raise ValueError(f"Unknown variant {name}, choose from: {', '.join(VARIANTS)}")
+        selected.add(name)
+    return tuple(name for name in VARIANTS if name in selected)
+
+@instrumented
+def process_icon(img, base_name, output_folder, sizes=None, writer=None, variants=None, ranking=None):
+    #img is processed once at its own size, sizes lists the icon sizes written to every .ico
+    #variants is a tuple of VARIANTS names to make, None for all of them, and only the planes
+    #those need are computed
+    #ranking is (top_k, min_score) to only save the best scoring variants, see RankingWriter,
+    #no more variants are made once enough of them reached min_score
+    #the .ico files are encoded in the background and written together at the end,
+    #with a writer they are only queued on it and the caller flushes
+    #returns the paths of the saved versions, or None when processing failed
+    return process_icon_batch([img], [base_name], output_folder, sizes, writer, variants, ranking)[0]
+
+def process_icon_batch(images, base_names, output_folder, sizes=None, writer=None, variants=None, ranking=None):
+    #process_icon for several icons at once, arguments after base_names apply to every icon
+    #icons of the same size are stacked so their planes, threshold masks and characteristic splits
+    #are computed in one go, artifact removal, edges and encoding still run per icon
+    #returns the saved paths of every icon, None for the icons that failed
+    own_writer = writer is None
+    writer = writer or IcoWriter()
+    results = [None] * len(images)
+
+    by_size = {}
+    for index, img in enumerate(images):
+        by_size.setdefault(img.size, []).append(index)
+
+    for indices in by_size.values():
+        group_names = [base_names[i] for i in indices]
+        try:
+            group_images = [images[i].convert("RGBA") for i in indices]
+            group_results = process_icon_stack(group_images, group_names, output_folder, sizes, writer,
+                                               variants, ranking)
+        except Exception as e:
+            for base_name in group_names:
+                print(f"Failed to process icon for {base_name}: {e}")
+            continue
+        for index, paths in zip(indices, group_results):
+            results[index] = paths
+
+    if own_writer:
+        try:
+            with stage("encode.flush"):
+                writer.flush()
+        except Exception as e:
+            for base_name in base_names:
+                print(f"Failed to process icon for {base_name}: {e}")
+            return [None] * len(images)
+    return results
+
+def process_icon_stack(images, base_names, output_folder, sizes, writer, variants, ranking):
+    #the work of process_icon_batch for RGBA images that all have the same size
+    variants = tuple(VARIANTS) if variants is None else variants
+    pixels = np.stack([np.asarray(img) for img in images])
+    paths = [[] for _ in images]
+    failed = [False] * len(images)
+
+    targets = [writer] * len(images)
+    if ranking is not None:
+        with stage("score.planes"):
+            targets = [RankingWriter(writer, img, *ranking) for img in images]
+
+    def active(i):
+        #still being made: not failed and, when ranking, not enough good variants yet
+        return not failed[i] and not (ranking is not None and targets[i].done)
+
+    def fail(i, e):
+        print(f"Failed to process icon for {base_names[i]}: {e}")
+        failed[i] = True
 
-def create_characteristic_variations(img_path=None, output_folder=None, img=None, base_name=None):
+    #standard variations
+    thresholds = [v for v in THRESHOLD_VARIATIONS if v[0] in variants]
+    for filename_suffix, results in threshold_variations_batch(pixels, thresholds):
+        for i, base_name in enumerate(base_names):
+            if not active(i):
+                continue
+            try:
+                img_variant = Image.fromarray(results[i], "RGBA")
+                with stage(f"artifacts.{filename_suffix}"):
+                    img_variant = enhanced_remove_artifacts(img_variant)
+                record_pixels(filename_suffix, img_variant)
+                with stage(f"antialias.{filename_suffix}"):
+                    img_variant = apply_antialiasing(img_variant)
+                output_path = os.path.join(output_folder, f"{base_name}_{filename_suffix}.ico")
+                targets[i].add(output_path, img_variant, sizes)
+                if ranking is None:
+                    print(f"Saved {filename_suffix} version: {output_path}")
+                paths[i].append(output_path)
+            except Exception as e:
+                fail(i, e)
+        if not any(active(i) for i in range(len(images))):
+            break
+
+    #edge and line detection processing
+    edge_variants = [name for name in variants if VARIANTS[name] == "edges"]
+    for i, base_name in enumerate(base_names):
+        if edge_variants and active(i):
+            edge_paths = process_icon_with_edges(images[i], base_name, output_folder, sizes, targets[i], edge_variants)
+            if edge_paths is None:
+                failed[i] = True
+            else:
+                paths[i].extend(edge_paths)
+
+    #characteristic variations
+    todo = [i for i in range(len(images)) if active(i)]
+    if "characteristic" in variants and todo:
+        try:
+            all_stats = save_characteristic_variations(pixels[todo], [base_names[i] for i in todo], output_folder,
+                                                       sizes, [targets[i] for i in todo])
+        except Exception as e:
+            print(f"Failed to create characteristic variations: {e}")
+            all_stats = [None] * len(todo)
+        for i, stats in zip(todo, all_stats):
+            if stats:
+                paths[i].extend(os.path.join(output_folder, f"{base_names[i]}{suffix}.ico")
+                                for suffix in stats['suffixes'])
+
+    if ranking is not None:
+        for i in range(len(images)):
+            #the ranked variants of a failed icon are dropped, not written
+            if not failed[i]:
+                kept = targets[i].finish()
+                print(f"Kept {', '.join(f'{os.path.basename(p)} ({score:.2f})' for p, score in kept.items())}"
+                      f" of {targets[i].scored} scored versions")
+                paths[i] = list(kept)
+
+    return [None if failed[i] else paths[i] for i in range(len(images))]
+
+@instrumented
+def create_characteristic_variations(img_path=None, output_folder=None, img=None, base_name=None, sizes=None,
+                                     writer=None):
     #creates two opposing variations based on dominant image characteristics
+    #with a writer the files are only queued on it, the caller flushes
+    #returns the computed statistics, or None when nothing was created
+    own_writer = writer is None
+    writer = writer or IcoWriter()
     try:
         #handle both direct image input and path input
         if img_path is not None:
@@ -403,176 +1462,1308 @@ def create_characteristic_variations(img_path=None, output_folder=None, img=None
             base_name = os.path.splitext(os.path.basename(img_path))[0]
         elif img is None or base_name is None:
             raise ValueError("Either img_path or both img and base_name must be provided")
-            
-        width, height = img.size
-        
-        #analysis arrays
-        color_data = []
-        total_pixels = 0
-        
-        #collect color data
-        for y in range(height):
-            for x in range(width):
-                r, g, b, a = img.getpixel((x, y))
-                if a > 30:  #only consider visible pixels
-                    total_pixels += 1
-                    brightness = (r + g + b) / 3
-                    saturation = max(r, g, b) - min(r, g, b)
-                    color_temp = (r - b)  #simple warm-cool measure
-                    color_data.append({
-                        'pos': (x, y),
-                        'brightness': brightness,
-                        'saturation': saturation,
-                        'temperature': color_temp,
-                        'alpha': a
-                    })
-        
-        if not color_data:
-            return
-        
-        #calculate variances for each characteristic
-        avg_bright = sum(c['brightness'] for c in color_data) / total_pixels
-        avg_sat = sum(c['saturation'] for c in color_data) / total_pixels
-        avg_temp = sum(c['temperature'] for c in color_data) / total_pixels
-        
-        var_bright = sum((c['brightness'] - avg_bright) ** 2 for c in color_data)
-        var_sat = sum((c['saturation'] - avg_sat) ** 2 for c in color_data)
-        var_temp = sum((c['temperature'] - avg_temp) ** 2 for c in color_data)
-        
-        #determine dominant characteristic
-        characteristics = {
-            'brightness': (var_bright, avg_bright, '_light', '_dark'),
-            'saturation': (var_sat, avg_sat, '_saturated', '_muted'),
-            'temperature': (var_temp, avg_temp, '_warm', '_cool')
-        }
-        
-        dominant_char = max(characteristics.items(), key=lambda x: x[1][0])
-        
-        #create two opposing images
-        img_type1 = Image.new("RGBA", img.size, (255, 255, 255, 0))
-        img_type2 = Image.new("RGBA", img.size, (255, 255, 255, 0))
-        
-        #split pixels based on dominant characteristic
-        avg_value = dominant_char[1][1]
-        suffix1 = dominant_char[1][2]
-        suffix2 = dominant_char[1][3]
-        
-        for y in range(height):
-            for x in range(width):
-                r, g, b, a = img.getpixel((x, y))
-                if a > 30:
-                    value = {
-                        'brightness': (r + g + b) / 3,
-                        'saturation': max(r, g, b) - min(r, g, b),
-                        'temperature': (r - b)
-                    }[dominant_char[0]]
-                    
-                    if value > avg_value:
-                        img_type1.putpixel((x, y), (255, 255, 255, a))
-                    else:
-                        img_type2.putpixel((x, y), (255, 255, 255, a))
-        
-        #apply enhanced processing to characteristic variations
-        img_type1 = enhanced_remove_artifacts(img_type1)
-        img_type2 = enhanced_remove_artifacts(img_type2)
-        img_type1 = apply_antialiasing(img_type1)
-        img_type2 = apply_antialiasing(img_type2)
-        
-        #save variations
-        type1_path = os.path.join(output_folder, f"{base_name}{suffix1}.ico")
-        type2_path = os.path.join(output_folder, f"{base_name}{suffix2}.ico")
-        img_type1.save(type1_path, format='ICO')
-        img_type2.save(type2_path, format='ICO')
-        print(f"Created characteristic variations: {suffix1} and {suffix2}")
-        
+
+        pixels = np.asarray(img.convert("RGBA"))[np.newaxis]
+        stats = save_characteristic_variations(pixels, [base_name], output_folder, sizes, [writer])[0]
+        if own_writer and stats:
+            with stage("encode.flush"):
+                writer.flush()
+        return stats
+
     except Exception as e:
         print(f"Failed to create characteristic variations: {e}")
+    return None
+
+def characteristic_splits(pixels):
+    #splits every icon of a stack of RGBA arrays (N, H, W, 4) along its dominant characteristic
+    #returns per icon (stats, type1, type2) with the two opposing RGBA arrays, or None without visible pixels
+    with stage("characteristic.stats"):
+        visible = pixels[..., 3] > 30  #only consider visible pixels
+        rgb = pixels[..., :3].astype(np.int32)
+        planes = {
+            'brightness': rgb.sum(axis=-1) / 3,
+            'saturation': rgb.max(axis=-1) - rgb.min(axis=-1),
+            'temperature': rgb[..., 0] - rgb[..., 2],  #simple warm-cool measure
+        }
+
+        all_stats = []
+        for i in range(len(pixels)):
+            total_pixels = int(visible[i].sum())
+            if not total_pixels:
+                all_stats.append(None)
+                continue
+
+            #characteristic values of the visible pixels, in row order
+            values = {name: plane[i][visible[i]] for name, plane in planes.items()}
+
+            #the float brightness total goes through the builtin sum so the average (and every
+            #pixel sitting right on it) rounds exactly like the per-pixel version did
+            avg_bright = sum(values['brightness'].tolist()) / total_pixels
+            avg_sat = int(values['saturation'].sum()) / total_pixels
+            avg_temp = int(values['temperature'].sum()) / total_pixels
+
+            var_bright = float(np.square(values['brightness'] - avg_bright).sum())
+            var_sat = float(np.square(values['saturation'] - avg_sat).sum())
+            var_temp = float(np.square(values['temperature'] - avg_temp).sum())
+
+            #determine dominant characteristic
+            characteristics = {
+                'brightness': (var_bright, avg_bright, *CHARACTERISTIC_SUFFIXES['brightness']),
+                'saturation': (var_sat, avg_sat, *CHARACTERISTIC_SUFFIXES['saturation']),
+                'temperature': (var_temp, avg_temp, *CHARACTERISTIC_SUFFIXES['temperature'])
+            }
+            dominant_char = max(characteristics.items(), key=lambda x: x[1][0])
+
+            all_stats.append({
+                'pixels': total_pixels,
+                'brightness': {'mean': avg_bright, 'variance': var_bright},
+                'saturation': {'mean': avg_sat, 'variance': var_sat},
+                'temperature': {'mean': avg_temp, 'variance': var_temp},
+                'dominant': dominant_char[0],
+                'suffixes': dominant_char[1][2:],
+            })
+
+    with stage("characteristic.split"):
+        #split pixels based on the dominant characteristic of each icon
+        splits = []
+        for i, stats in enumerate(all_stats):
+            if stats is None:
+                splits.append(None)
+                continue
+            dominant = stats['dominant']
+            above = visible[i] & (planes[dominant][i] > stats[dominant]['mean'])
+            alpha = pixels[i, :, :, 3]
+
+            #create two opposing images
+            type1 = np.full(pixels.shape[1:], 255, dtype=np.uint8)
+            type2 = np.full(pixels.shape[1:], 255, dtype=np.uint8)
+            type1[:, :, 3] = np.where(above, alpha, 0)
+            type2[:, :, 3] = np.where(visible[i] & ~above, alpha, 0)
+            splits.append((stats, type1, type2))
+    return splits
+
+def save_characteristic_variations(pixels, base_names, output_folder, sizes, writers):
+    #queues both characteristic variations of every icon of the stack on its writer
+    #returns the statistics of every icon, None for icons without visible pixels or that failed
+    all_stats = []
+    for base_name, writer, split in zip(base_names, writers, characteristic_splits(pixels)):
+        if split is None:
+            all_stats.append(None)
+            continue
+        try:
+            stats, type1, type2 = split
+            suffix1, suffix2 = stats['suffixes']
+            img_type1 = Image.fromarray(type1, "RGBA")
+            img_type2 = Image.fromarray(type2, "RGBA")
+
+            #apply enhanced processing to characteristic variations
+            with stage("artifacts.characteristic"):
+                img_type1 = enhanced_remove_artifacts(img_type1)
+                img_type2 = enhanced_remove_artifacts(img_type2)
+            record_pixels(suffix1.lstrip('_'), img_type1)
+            record_pixels(suffix2.lstrip('_'), img_type2)
+            with stage("antialias.characteristic"):
+                img_type1 = apply_antialiasing(img_type1)
+                img_type2 = apply_antialiasing(img_type2)
+
+            #save variations
+            type1_path = os.path.join(output_folder, f"{base_name}{suffix1}.ico")
+            type2_path = os.path.join(output_folder, f"{base_name}{suffix2}.ico")
+            writer.add(type1_path, img_type1, sizes)
+            writer.add(type2_path, img_type2, sizes)
+            if not isinstance(writer, RankingWriter):
+                print(f"Created characteristic variations: {suffix1} and {suffix2}")
+            all_stats.append(stats)
+        except Exception as e:
+            print(f"Failed to create characteristic variations: {e}")
+            all_stats.append(None)
+    return all_stats
+
+def tokenize_vdf(text):
+    #yields the strings and braces of Valve KeyValues text, skipping comments and [$CONDITIONAL] tags
+    escapes = {'n': '\n', 't': '\t', '\\': '\\', '"': '"'}
+    i, length = 0, len(text)
+    while i < length:
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = length if end == -1 else end
+        elif c in '{}':
+            yield c
+            i += 1
+        elif c == '[':
+            end = text.find(']', i)
+            i = length if end == -1 else end + 1
+        elif c == '"':
+            i += 1
+            chars = []
+            while i < length and text[i] != '"':
+                if text[i] == '\\' and i + 1 < length:
+                    i += 1
+                    chars.append(escapes.get(text[i], '\\' + text[i]))
+                else:
+                    chars.append(text[i])
+                i += 1
+            yield ''.join(chars)
+            i += 1
+        else:
+            start = i
+            while i < length and not text[i].isspace() and text[i] not in '{}"':
+                i += 1
+            yield text[start:i]
+
+def parse_vdf(text):
+    #parses Valve KeyValues text (libraryfolders.vdf, appmanifest_*.acf) into nested dicts
+    root = {}
+    stack = [root]
+    key = None
+    for token in tokenize_vdf(text):
+        if token == '{':
+            child = {}
+            stack[-1][key] = child
+            stack.append(child)
+            key = None
+        elif token == '}':
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif key is None:
+            key = token
+        else:
+            stack[-1][key] = token
+            key = None
+    return root
+
+def read_vdf(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return parse_vdf(f.read())
+
+#how long a single drive or library may take to answer during discovery, in seconds
+#a stalled network share or a spun-down disk is skipped for the run instead of holding it up
+DISCOVERY_TIMEOUT = 5.0
+
+#where Steam and its libraries usually sit on a volume, and under the home folder outside Windows
+STEAM_VOLUME_FOLDERS = (os.path.join('Program Files (x86)', 'Steam'), os.path.join('Program Files', 'Steam'),
+                        'Steam', 'SteamLibrary')
+STEAM_HOME_FOLDERS = (os.path.join('.steam', 'steam'), os.path.join('.local', 'share', 'Steam'),
+                      os.path.join('.var', 'app', 'com.valvesoftware.Steam', '.local', 'share', 'Steam'))
+
+#GetDriveTypeW results worth probing: removable, fixed, network and RAM disks (optical drives and
+#missing roots are left out, an empty drive can hang for a while)
+GAME_DRIVE_TYPES = (2, 3, 4, 6)
+
+#/proc/mounts entries that never hold games
+PSEUDO_FILESYSTEMS = {'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs', 'debugfs', 'devpts',
+                      'devtmpfs', 'fusectl', 'hugetlbfs', 'mqueue', 'nsfs', 'proc', 'pstore', 'securityfs',
+                      'squashfs', 'sysfs', 'tmpfs', 'tracefs'}
+
+def mounted_volumes():
+    #root folders of the mounted volumes: the drive letters in use on Windows, the real
+    #filesystems of /proc/mounts on Linux, / and /Volumes/* elsewhere
+    if os.name == 'nt':
+        kernel32 = ctypes.windll.kernel32
+        mask = kernel32.GetLogicalDrives()
+        drives = [f"{chr(ord('A') + i)}:\\" for i in range(26) if mask >> i & 1]
+        return [drive for drive in drives if kernel32.GetDriveTypeW(drive) in GAME_DRIVE_TYPES]
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8', errors='replace') as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        volumes = [os.sep]
+        with contextlib.suppress(OSError):
+            volumes += [os.path.join('/Volumes', name) for name in sorted(os.listdir('/Volumes'))]
+        return volumes
+    volumes = []
+    for fields in mounts:
+        if len(fields) < 3 or fields[2] in PSEUDO_FILESYSTEMS:
+            continue
+        #spaces and other special characters are escaped as \ooo
+        volume = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+        if volume not in volumes:
+            volumes.append(volume)
+    return volumes
+
+def steam_root_candidates():
+    #folders that may be a Steam install or library, most likely first
+    candidates = [os.path.join(volume, folder) for volume in mounted_volumes() for folder in STEAM_VOLUME_FOLDERS]
+    if os.name != 'nt':
+        home = os.path.expanduser('~')
+        candidates = [os.path.join(home, folder) for folder in STEAM_HOME_FOLDERS] + candidates
+    return candidates
 
-def find_steam_libraries():
-    #fFinds all Steam library folders on the system
+def read_concurrently(paths, read, timeout=DISCOVERY_TIMEOUT):
+    #read(path) for every path at once, results in the order of paths
+    #a path that raises or does not answer within timeout seconds gets None
+    #daemon threads instead of a pool: a call stuck on a dead share cannot be cancelled, and pool
+    #threads would keep the process from exiting until it returns
+    results = [None] * len(paths)
+
+    def run(i, path):
+        try:
+            results[i] = read(path)
+        except Exception as e:
+            print(f"Failed to read {path}: {e}")
+
+    threads = [threading.Thread(target=run, args=(i, path), daemon=True) for i, path in enumerate(paths)]
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.start()
+    for path, thread in zip(paths, threads):
+        thread.join(max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            print(f"Skipping {path}, no answer within {timeout:g} seconds.")
+    #a thread finishing after its join does not count
+    return [result if not thread.is_alive() else None for result, thread in zip(results, threads)]
+
+def probe_steam_root(path):
+    #(real path, library paths listed in its libraryfolders.vdf) of a Steam folder, None when there is none
+    if not os.path.isdir(path):
+        return None
+    libraries = []
+    libraryfolders_path = os.path.join(path, 'steamapps', 'libraryfolders.vdf')
+    if os.path.exists(libraryfolders_path):
+        vdf = read_vdf(libraryfolders_path)
+        folders = vdf.get('libraryfolders') or vdf.get('LibraryFolders') or {}
+        for folder_id, folder in folders.items():
+            if not folder_id.isdigit():
+                continue
+            #new format nests the path in a block, old format stores it directly
+            library_path = folder.get('path') if isinstance(folder, dict) else folder
+            if library_path:
+                libraries.append(library_path)
+    return os.path.realpath(path), libraries
+
+def probe_library(path):
+    #real path of an existing library folder, None when it is gone
+    return os.path.realpath(path) if os.path.isdir(path) else None
+
+def find_steam_libraries(timeout=DISCOVERY_TIMEOUT):
+    #finds all Steam library folders on the system
+    #every mounted volume is probed at once, then every library their libraryfolders.vdf list,
+    #a folder reached through several paths (symlinks, mount points) is only returned once
     steam_libraries = []
-    drives = ['C:', 'D:', 'E:', 'F:', 'G:', 'H:', 'I:', 'J:']  #add or remove drives as needed, OP's config
-    
-    for drive in drives:
-        steam_path = os.path.join(drive, os.sep, 'Program Files (x86)', 'Steam')
-        if os.path.exists(steam_path):
-            steam_libraries.append(steam_path)
-            #check for additional library folders in libraryfolders.vdf
-            libraryfolders_path = os.path.join(steam_path, 'steamapps', 'libraryfolders.vdf')
-            if os.path.exists(libraryfolders_path):
-                with open(libraryfolders_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if '"path"' in line:
-                            library_path = line.split('"path"')[1].split('"')[1]
-                            if os.path.exists(library_path):
-                                steam_libraries.append(library_path)
-    
+    seen = set()
+
+    def add_library(path, real_path):
+        key = os.path.normcase(os.path.normpath(real_path))
+        if key not in seen:
+            seen.add(key)
+            steam_libraries.append(path)
+
+    candidates = steam_root_candidates()
+    roots = [(path, found) for path, found in zip(candidates, read_concurrently(candidates, probe_steam_root, timeout))
+             if found]
+    listed = []
+    for path, (real_path, libraries) in roots:
+        add_library(path, real_path)
+        listed.extend(libraries)
+
+    #libraries on other drives are checked too, the drive may have been unplugged since
+    listed = list(dict.fromkeys(listed))
+    for path, real_path in zip(listed, read_concurrently(listed, probe_library, timeout)):
+        if real_path:
+            add_library(path, real_path)
     return steam_libraries
 
-def find_steam_app_icons(steam_libraries):
-    #finds Steam app icons in the given Steam libraries
-    steam_icons = []
-    for library in steam_libraries:
-        steamapps_path = os.path.join(library, 'steamapps', 'common')
-        if os.path.exists(steamapps_path):
-            for root, dirs, files in os.walk(steamapps_path):
-                for file in files:
-                    if file.lower().endswith('.exe'):
-                        steam_icons.append(os.path.join(root, file))
-    return steam_icons
-
-def main():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_folder = os.path.join(script_dir, "Processed_Icons")
-    os.makedirs(output_folder, exist_ok=True)
-    
-    files_processed = False
-    
+def read_app_manifests(library):
+    #AppState blocks of every appmanifest_*.acf in a library, sorted by appid
+    steamapps_path = os.path.join(library, 'steamapps')
+    manifests = []
+    if not os.path.isdir(steamapps_path):
+        return manifests
+    for file in os.listdir(steamapps_path):
+        if file.lower().startswith('appmanifest_') and file.lower().endswith('.acf'):
+            try:
+                app_state = read_vdf(os.path.join(steamapps_path, file)).get('AppState')
+            except OSError as e:
+                print(f"Failed to read {file}: {e}")
+                continue
+            if isinstance(app_state, dict) and app_state.get('installdir'):
+                manifests.append(app_state)
+    return sorted(manifests, key=lambda m: int(m['appid']) if m.get('appid', '').isdigit() else 0)
+
+def scan_executables(root, old_dirs, new_dirs):
+    #lists the .exe files under root as {path: (mtime, size)}
+    #directories whose mtime matches old_dirs reuse their recorded listing instead of being read again,
+    #every visited directory is recorded in new_dirs for the next scan
+    executables = {}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+
+        entry = old_dirs.get(path)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, 'exes': {}, 'subdirs': []}
+            try:
+                with os.scandir(path) as it:
+                    for item in it:
+                        try:
+                            if item.is_dir(follow_symlinks=False):
+                                entry['subdirs'].append(item.name)
+                            elif item.name.lower().endswith('.exe'):
+                                st = item.stat()
+                                entry['exes'][item.name] = [st.st_mtime, st.st_size]
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+        new_dirs[path] = entry
+        for name, (exe_mtime, size) in entry['exes'].items():
+            executables[os.path.join(path, name)] = (exe_mtime, size)
+        stack.extend(os.path.join(path, name) for name in entry['subdirs'])
+    return executables
+
+#executables that ship with games but are not the game itself
+NON_GAME_EXE_WORDS = (
+    'redist', 'crash', 'setup', 'install', 'unins', 'dxsetup', 'directx', 'dotnet', 'physx',
+    'prereq', 'anticheat', 'battleye', 'report', 'helper', 'update', 'cefprocess', 'server',
+)
+
+def simplify_name(name):
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+def pick_main_executable(game_dir, executables, names=()):
+    #picks the executable that most likely is the game itself
+    #prefers names matching the game, shallow paths and big files, and skips redistributables and tools
+    game_names = [simplify_name(n) for n in names if simplify_name(n)]
+
+    def score(item):
+        path, (_, size) = item
+        relative = os.path.relpath(path, game_dir).lower()
+        stem = simplify_name(os.path.splitext(os.path.basename(path))[0])
+        value = -relative.count(os.sep) * 10 + min(size, 1 << 30) / (1 << 30) * 10
+        if any(stem == n for n in game_names):
+            value += 100
+        elif any(stem and (stem in n or n in stem) for n in game_names):
+            value += 50
+        return value
+
+    candidates = [item for item in executables.items()
+                  if not any(word in os.path.relpath(item[0], game_dir).lower() for word in NON_GAME_EXE_WORDS)]
+    if not candidates:
+        candidates = list(executables.items())
+    if not candidates:
+        return None
+    return max(sorted(candidates), key=score)[0]
+
+STEAM_INDEX_FILE = ".steam_index.json"
+STEAM_INDEX_VERSION = 1
+
+def load_steam_index(index_path):
+    if index_path and os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == STEAM_INDEX_VERSION:
+                return index
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable Steam index {index_path}: {e}")
+    return {'version': STEAM_INDEX_VERSION, 'dirs': {}}
+
+def save_steam_index(index_path, index):
+    #written to a temporary file first so an interrupted run never leaves a broken index
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temp_path, index_path)
+
+def find_steam_app_icons(steam_libraries, index_path=None, all_executables=False):
+    #yields Steam app icons in the given Steam libraries as they are found
+    #one main executable per installed game (from the appmanifest files), or every .exe with all_executables
+    #with an index_path, directory listings are persisted and unchanged directories are not read again
+    index = load_steam_index(index_path)
+    old_dirs = index['dirs']
+    new_dirs = {}
+    finished = False
+
+    try:
+        for library in steam_libraries:
+            steamapps_path = os.path.join(library, 'steamapps', 'common')
+            if not os.path.exists(steamapps_path):
+                continue
+
+            if all_executables:
+                yield from sorted(scan_executables(steamapps_path, old_dirs, new_dirs))
+                continue
+
+            manifests = read_app_manifests(library)
+            if manifests:
+                games = [(m['installdir'], (m.get('name', ''), m['installdir'])) for m in manifests]
+            else:
+                #no manifests (copied or unregistered library), treat every folder as a game
+                games = [(d, (d,)) for d in sorted(os.listdir(steamapps_path))]
+
+            for installdir, names in games:
+                game_dir = os.path.join(steamapps_path, installdir)
+                if not os.path.isdir(game_dir):
+                    continue
+                executable = pick_main_executable(game_dir, scan_executables(game_dir, old_dirs, new_dirs), names)
+                if executable:
+                    yield executable
+        finished = True
+    finally:
+        if index_path:
+            #a scan stopped early only saw part of the libraries, the listings it did not get to are kept
+            dirs = new_dirs if finished else {**old_dirs, **new_dirs}
+            try:
+                save_steam_index(index_path, {'version': STEAM_INDEX_VERSION, 'dirs': dirs})
+            except OSError as e:
+                print(f"Failed to save Steam index {index_path}: {e}")
+
+#bump whenever a change to the processing functions changes their output,
+#cached results from older versions are then ignored
+PIPELINE_VERSION = 6
+
+CACHE_FOLDER = ".icon_cache"
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+def pipeline_fingerprint():
+    #identifies the processing parameters that cached results were produced with
+    params = (PIPELINE_VERSION, THRESHOLD_VARIATIONS, EDGE_PREPROCESS, TRANSPARENCY_PREPROCESS,
+              ICO_SIZES, ICO_MAX_SIZE)
+    return hashlib.sha256(repr(params).encode()).hexdigest()
+
+def icon_cache_key(img, sizes=None, variants=None, ranking=None):
+    #content address of an extracted icon: its pixels, output sizes, selected variants and ranking
+    #plus the pipeline fingerprint
+    img = img.convert("RGBA")
+    digest = hashlib.sha256(pipeline_fingerprint().encode())
+    digest.update(f"{img.size[0]}x{img.size[1]} {sizes}".encode())
+    if variants is not None:
+        digest.update(f" {','.join(variants)}".encode())
+    if ranking is not None:
+        digest.update(f" ranked {ranking}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def perceptual_hash(img, hash_size=8):
+    #difference hash of the icon over white, close icons (other size, slightly different artwork) get the same hash
+    img = img.convert("RGBA")
+    flat = Image.alpha_composite(Image.new("RGBA", img.size, "white"), img).convert("L")
+    pixels = np.asarray(flat.resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+def claim_cached_icon(cache_dir, key, poll=0.05):
+    #makes sure only one worker processes an icon at a time
+    #returns the claim file to release once the entry is stored, or None when another worker
+    #already stored the entry in the meantime and it can be restored
+    os.makedirs(cache_dir, exist_ok=True)
+    claim = os.path.join(cache_dir, f".claim-{key}")
+    while True:
+        try:
+            os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return claim
+        except FileExistsError:
+            pass
+        #someone else is on it, wait until they stored it or gave up
+        while os.path.exists(claim):
+            time.sleep(poll)
+        if os.path.isdir(os.path.join(cache_dir, key)):
+            return None
+
+def release_cached_icon(claim):
+    with contextlib.suppress(OSError):
+        os.remove(claim)
+
+def clear_icon_claims(cache_dir):
+    #claims left behind by a run that was killed would block every later run
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.startswith(".claim-"):
+                release_cached_icon(os.path.join(cache_dir, name))
+
+def lookup_cached_icon(cache_dir, key):
+    #returns the cache entry folder for key, or None on a miss
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    os.utime(entry)  #mark as recently used for eviction
+    return entry
+
+def restore_cached_icon(entry, base_name, output_folder, writer):
+    #queues the files of a cache entry on writer under base_name, returns the new paths
+    paths = []
+    for suffix_file in sorted(os.listdir(entry)):
+        output_path = os.path.join(output_folder, f"{base_name}{suffix_file}")
+        with open(os.path.join(entry, suffix_file), 'rb') as f:
+            writer.add_bytes(output_path, f.read())
+        paths.append(output_path)
+    return paths
+
+def store_cached_icon(cache_dir, key, base_name, files):
+    #stores processed outputs ({path: bytes}) under key, files are kept by suffix so any base_name can reuse them
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    try:
+        for path, data in files.items():
+            suffix_file = os.path.basename(path)[len(base_name):]
+            with open(os.path.join(staging, suffix_file), 'wb') as f:
+                f.write(data)
+        #publish the finished entry in one step, another worker may have beaten us to it
+        os.chmod(staging, 0o777 & ~UMASK)
+        os.rename(staging, os.path.join(cache_dir, key))
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def icon_cache_entries(cache_dir):
+    #[(mtime, size, path)] of every entry, processed icons (folders) and stored extractions (files)
+    #staging and claims start with a dot and are left out
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith("."):
+            continue
+        if os.path.isdir(entry):
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        else:
+            size = os.path.getsize(entry)
+        entries.append((os.path.getmtime(entry), size, entry))
+    return entries
+
+def evict_icon_cache(cache_dir, max_bytes):
+    #removes least recently used entries until the cache fits in max_bytes, returns how many went
+    entries = icon_cache_entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            with contextlib.suppress(OSError):
+                os.remove(entry)
+        total -= size
+        removed += 1
+    return removed
+
+def invalidate_icon_cache(cache_dir):
+    #drops every cached result, returns the number of entries removed
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = len(os.listdir(cache_dir))
+    shutil.rmtree(cache_dir)
+    return removed
+
+#desktop files that are turned into icons
+SOURCE_EXTENSIONS = ('.lnk', '.exe', '.dll', '.ico', '.url')
+
+def discover_sources(script_dir):
+    #yields (base_name, source_path) for every desktop file and Steam executable, in processing order
+    #Steam libraries are scanned as the stream is consumed, so icons are processed while the scan goes on
+    #a file found more than once (the desktop is a Steam library, a library reached through a link) is
+    #only yielded the first time
+    seen = set()
+
+    def first_time(path):
+        key = os.path.normcase(os.path.realpath(path))
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
     #search for .lnk, .exe, .dll, and .ico files
-    valid_extensions = ('.lnk', '.exe', '.dll', '.ico', '.url')
     for file in os.listdir(script_dir):
-        if file.lower().endswith(valid_extensions):
-            file_path = os.path.join(script_dir, file)
-            base_name = os.path.splitext(file)[0]
-            
-            if file.lower().endswith('.lnk'):
-                icon_path = get_target_and_icon_from_lnk(file_path)
-            else:
-                icon_path = file_path  #directly use .exe, .dll, or .ico files
-            
-            if icon_path:
-                img = extract_icon(icon_path)
-                if img:
-                    #save original icon
-                    icon_save_path = os.path.join(output_folder, f"{base_name}.ico")
-                    img.save(icon_save_path, format='ICO')
-                    process_icon(img, base_name, output_folder)
-                    files_processed = True
-                else:
-                    print(f"Skipping {file}, could not extract icon.")
-            else:
-                print(f"Skipping {file}, no valid icon found.")
-    
+        if file.lower().endswith(SOURCE_EXTENSIONS) and first_time(os.path.join(script_dir, file)):
+            yield os.path.splitext(file)[0], os.path.join(script_dir, file)
+
     #search for Steam app icons
     steam_libraries = find_steam_libraries()
-    steam_icons = find_steam_app_icons(steam_libraries)
-    for icon_path in steam_icons:
-        base_name = os.path.splitext(os.path.basename(icon_path))[0]
-        img = extract_icon(icon_path)
-        if img:
-            #save original icon
-            icon_save_path = os.path.join(output_folder, f"{base_name}.ico")
-            img.save(icon_save_path, format='ICO')
-            process_icon(img, base_name, output_folder)
-            files_processed = True
+    index_path = os.path.join(script_dir, STEAM_INDEX_FILE)
+    for icon_path in find_steam_app_icons(steam_libraries, index_path=index_path):
+        if first_time(icon_path):
+            yield os.path.splitext(os.path.basename(icon_path))[0], icon_path
+
+def filter_sources(sources, pattern=None, limit=None):
+    #narrows a source stream to base names matching the glob pattern (case-insensitive), at most limit of them
+    if pattern:
+        sources = (s for s in sources if fnmatch.fnmatch(s[0].lower(), pattern.lower()))
+    if limit is not None:
+        sources = itertools.islice(sources, max(limit, 0))
+    return sources
+
+def prefetch(iterable, maxsize):
+    #runs iterable on a background thread, staying at most maxsize items ahead of the consumer
+    #errors are raised in the consumer, a consumer that stops early stops the thread too
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
         else:
-            print(f"Skipping {icon_path}, could not extract icon.")
-    
-    if files_processed:
-        print("Processing complete. Check the 'Processed_Icons' folder.")
+            put((False, None))
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
+
+@instrumented
+def process_source(base_name, source_path, output_folder, cache_dir=None, writer=None, hashes=None,
+                   variants=None, ranking=None, store_dir=None):
+    #extracts and processes one source, returns True when an icon was processed, False when it was
+    #skipped (no icon) and raises when processing failed
+    #with a cache_dir, icons that were processed before (in this run or an earlier one, under any
+    #name) are restored instead of reprocessed, and workers never process the same icon at once
+    #every .ico of the source is written when the writer is flushed at the end
+    #hashes receives (exact, perceptual) hashes of the extracted icon for the duplicate report
+    #variants and ranking are passed on to process_icon, store_dir on to extract_icon_images
+    writer = writer or IcoWriter()
+    file = os.path.basename(source_path)
+
+    if file.lower().endswith(('.lnk', '.url')):
+        icon_path, icon_index = get_icon_location(source_path)
     else:
-        print("No icons were processed.")
+        icon_path, icon_index = source_path, 0  #directly use .exe, .dll, or .ico files
 
-if __name__ == "__main__":
-    main()
+    if not icon_path:
+        print(f"Skipping {file}, no valid icon found.")
+        return False
+
+    with stage("extract"):
+        images = extract_icon_images(icon_path, icon_index, store_dir=store_dir)
+    if not images:
+        print(f"Skipping {file}, could not extract icon.")
+        return False
+
+    #the largest embedded size is processed, every embedded size is written
+    img = images[0]
+    sizes = [i.size for i in images]
+
+    #save original icon with its own images for every size
+    icon_save_path = os.path.join(output_folder, f"{base_name}.ico")
+    writer.add(icon_save_path, images, sizes)
+
+    with stage("hash"):
+        key = icon_cache_key(img, sizes, variants, ranking)
+        if hashes is not None:
+            hashes.append((key, perceptual_hash(img)))
+
+    claim = None
+    if cache_dir:
+        with stage("cache.lookup"):
+            entry = lookup_cached_icon(cache_dir, key)
+            if not entry:
+                claim = claim_cached_icon(cache_dir, key)
+                entry = None if claim else lookup_cached_icon(cache_dir, key)
+        if entry:
+            with stage("cache.restore"):
+                paths = restore_cached_icon(entry, base_name, output_folder, writer)
+                writer.flush()
+            print(f"Restored {len(paths)} cached versions for {base_name}")
+            return True
+
+    try:
+        paths = process_icon(img, base_name, output_folder, sizes, writer, variants, ranking)
+        with stage("encode.flush"):
+            written = writer.flush()
+        if cache_dir and paths is not None:
+            with stage("cache.store"):
+                store_cached_icon(cache_dir, key, base_name, {path: written[path] for path in paths})
+    finally:
+        if claim:
+            release_cached_icon(claim)
+    if paths is None:
+        #process_icon reported the error already, run_group counts the source as failed
+        raise RuntimeError("no versions could be made")
+    return True
+
+def run_group(group, output_folder, cache_dir=None, capture=True, bundle=False, variants=None, ranking=None,
+              store_dir=None):
+    #batch work item, returns (base_name, status, log, trace records, files, hashes) and never raises
+    #files maps file names to .ico bytes when bundling, otherwise the files are on disk and it is empty
+    #hashes lists the (exact, perceptual) hashes of the icons that were extracted
+    base_name, source_paths = group
+    log = io.StringIO()
+    status = "skipped"
+    writer = IcoWriter(collect=bundle)
+    hashes = []
+
+    with contextlib.redirect_stdout(log) if capture else contextlib.nullcontext():
+        for source_path in source_paths:
+            try:
+                if process_source(base_name, source_path, output_folder, cache_dir, writer, hashes, variants, ranking,
+                                  store_dir):
+                    status = "processed"
+            except Exception as e:
+                print(f"Failed to process {source_path}: {e}")
+                status = "failed"
+
+    return base_name, status, log.getvalue(), drain_trace_records(), writer.files, hashes
+
+def run_batch(sources, output_folder, workers=None, max_in_flight=None, cache_dir=None, bundle_path=None,
+              variants=None, ranking=None, store_dir=None):
+    #processes an iterable of (base_name, source_path) on a pool of worker processes and prints
+    #progress in source order, sources are pulled only as fast as the workers take them
+    #with a bundle_path every .ico goes into that one zip archive instead of the output folder
+    #variants and ranking limit the versions made and saved per icon, see process_icon
+    #identical icons are processed once, through the cache or a scratch one for this run when it is off
+    #with a store_dir the extracted icons are kept there between runs, see extract_icon_images
+    #returns a summary dict with the number of processed, skipped, failed and duplicate sources,
+    #plus the 'identical' and 'similar' groups of names from duplicate_groups
+    with contextlib.ExitStack() as stack:
+        if cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="icon-dedup-"))
+        else:
+            clear_icon_claims(cache_dir)
+        bundle = stack.enter_context(bundle_writer(bundle_path))
+        return _run_batch(sources, output_folder, workers, max_in_flight, cache_dir, bundle, variants, ranking,
+                          store_dir)
+
+def duplicate_groups(hashes):
+    #hashes is [(base_name, exact, perceptual)], returns (identical, similar) lists of name groups
+    #identical icons shared their outputs, similar ones only look alike and were processed each
+    by_exact = {}
+    for base_name, exact, perceptual in hashes:
+        by_exact.setdefault(exact, (perceptual, {}))[1][base_name] = True
+    by_perceptual = {}
+    for perceptual, names in by_exact.values():
+        by_perceptual.setdefault(perceptual, []).append(next(iter(names)))
+    identical = [list(names) for _, names in by_exact.values() if len(names) > 1]
+    similar = [names for names in by_perceptual.values() if len(names) > 1]
+    return identical, similar
+
+@contextlib.contextmanager
+def bundle_writer(bundle_path):
+    #zip archive filled while the batch runs and moved into place only once it completed
+    if bundle_path is None:
+        yield None
+        return
+    import zipfile
+    handle, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(os.path.abspath(bundle_path)))
+    os.close(handle)
+    try:
+        #.ico entries are already PNG-compressed, deflating them again buys nothing
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as bundle:
+            yield bundle
+        publish_file(temp_path, bundle_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+def _run_batch(sources, output_folder, workers, max_in_flight, cache_dir, bundle, variants, ranking, store_dir):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(max_in_flight or workers * 2, 1)
+    summary = {"total": 0, "processed": 0, "skipped": 0, "failed": 0}
+    hashes = []
+
+    def report(index, result):
+        base_name, status, log, records, files, icon_hashes = result
+        print(log, end="")
+        print(f"[{index}] {base_name}: {status}")
+        write_trace_records(records)
+        if bundle is not None:
+            for name, data in files.items():
+                bundle.writestr(name, data)
+        hashes.extend((base_name, exact, perceptual) for exact, perceptual in icon_hashes)
+        summary["total"] += 1
+        summary[status] += 1
+
+    def finish():
+        summary["identical"], summary["similar"] = duplicate_groups(hashes)
+        summary["duplicates"] = len(hashes) - len({exact for _, exact, _ in hashes})
+        return summary
+
+    #sources arrive one by one, a work item is a group of one
+    groups = ((base_name, [source_path]) for base_name, source_path in sources)
+
+    if workers == 1:
+        for index, group in enumerate(groups, 1):
+            report(index, run_group(group, output_folder, cache_dir, capture=False, bundle=bundle is not None,
+                                    variants=variants, ranking=ranking, store_dir=store_dir))
+        return finish()
+
+    def collect(index, group, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            #the worker process itself died, everything else keeps going
+            result = (group[0], "failed", f"Failed to process {group[0]}: {e}\n", [], {}, [])
+        report(index, result)
+
+    #workers collect their own records and hand them back with each result
+    initializer, initargs = None, ()
+    if _instrumentation is not None:
+        initializer, initargs = enable_instrumentation, (None, _instrumentation['profile_dir'], _instrumentation['summary'])
+
+    #multiprocessing is only imported once a pool is needed, single icon runs do without
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        in_flight = deque()
+        for index, group in enumerate(groups, 1):
+            #sources sharing a base_name write the same files, the earlier one has to be done
+            #before the next starts so the last one still wins like it does in a serial run
+            while any(queued[0] == group[0] for _, queued, _ in in_flight):
+                collect(*in_flight.popleft())
+
+            try:
+                future = pool.submit(run_group, group, output_folder, cache_dir, True, bundle is not None,
+                                     variants, ranking, store_dir)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            in_flight.append((index, group, future))
+
+            #bounded: wait for the oldest item before queueing more work
+            if len(in_flight) >= max_in_flight:
+                collect(*in_flight.popleft())
+
+        while in_flight:
+            collect(*in_flight.popleft())
+
+    return finish()
+
+def output_files(output_folder, base_name):
+    #every file processing base_name can leave in output_folder, whichever variants were made
+    suffixes = [""]
+    suffixes += [f"_{name}" for name in VARIANTS if name != "characteristic"]
+    suffixes += [suffix for pair in CHARACTERISTIC_SUFFIXES.values() for suffix in pair]
+    return [os.path.join(output_folder, f"{base_name}{suffix}.ico") for suffix in suffixes]
+
+def prune_outputs(output_folder, base_name):
+    #deletes the outputs of a source that went away, returns how many files were removed
+    removed = 0
+    for path in output_files(output_folder, base_name):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+            removed += 1
+    return removed
+
+def snapshot_sources(sources, snapshot):
+    #passes sources through while recording {source_path: (base_name, size, mtime)} of each in snapshot
+    for base_name, path in sources:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        snapshot[path] = (base_name, st.st_size, st.st_mtime_ns)
+        yield base_name, path
+
+def diff_snapshots(old, new):
+    #(changed, removed): changed lists (base_name, source_path) of added or modified sources in discovery
+    #order, removed the base names whose last source is gone
+    changed = [(entry[0], path) for path, entry in new.items() if old.get(path) != entry]
+    remaining = {entry[0] for entry in new.values()}
+    removed = sorted({entry[0] for path, entry in old.items() if path not in new} - remaining)
+    return changed, removed
+
+def watched_folders(script_dir):
+    #(folder, is_relevant(name)) for the desktop folder and every Steam library, only changes to
+    #relevant names trigger a rescan so the files this script writes itself are ignored
+    folders = [(script_dir, lambda name: name.lower().endswith(SOURCE_EXTENSIONS))]
+    for library in find_steam_libraries():
+        steamapps = os.path.join(library, 'steamapps')
+        #installs and uninstalls rewrite the app manifests, new game folders show up in common
+        folders.append((steamapps, lambda name: name.startswith('appmanifest_') or name == 'libraryfolders.vdf'))
+        folders.append((os.path.join(steamapps, 'common'), lambda name: True))
+    return [(folder, is_relevant) for folder, is_relevant in folders if os.path.isdir(folder)]
 
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+class InotifyWatcher:
+    #change notifications for a few folders (not recursive) through the Linux inotify API, via ctypes
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.relevant = {}
+        for folder, is_relevant in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, f"inotify_add_watch failed for {folder}")
+            self.relevant[wd] = is_relevant
+
+    def wait(self, timeout):
+        #True when a relevant name changed within timeout seconds, consumes the pending events
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                return False
+            if self._drain():
+                return True
+
+    def _drain(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if wd in self.relevant and self.relevant[wd](name):
+                    changed = True
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    #fallback for systems without inotify: compares the size and mtime of the relevant names every interval
+
+    def __init__(self, folders, interval=5.0):
+        self.folders = folders
+        self.interval = interval
+        self.state = self._state()
+        #the next scan is due at next_poll, however short the timeouts passed to wait are
+        self.next_poll = time.monotonic() + interval
+
+    def _state(self):
+        state = {}
+        for folder, is_relevant in self.folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if is_relevant(entry.name):
+                            with contextlib.suppress(OSError):
+                                st = entry.stat()
+                                state[entry.path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return state
+
+    def wait(self, timeout):
+        #True when a relevant name changed within timeout seconds
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if self.next_poll > deadline:
+                time.sleep(max(deadline - now, 0))
+                return False
+            time.sleep(max(self.next_poll - now, 0))
+            self.next_poll = time.monotonic() + self.interval
+            state = self._state()
+            if state != self.state:
+                self.state = state
+                return True
+
+    def close(self):
+        pass
+
+def make_watcher(folders, poll_interval=5.0):
+    #inotify on Linux, polling everywhere else or when inotify is not available
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), polling for changes instead.")
+    return PollingWatcher(folders, poll_interval)
+
+def watch_sources(script_dir, output_folder, process, snapshot, name_filter=None, debounce=2.0, poll_interval=5.0,
+                  stop=None, limited=False):
+    #waits for changes in the desktop folder and the Steam libraries until interrupted (or stop is set),
+    #hands the added or changed sources to process and prunes the outputs of removed ones
+    #snapshot is what was processed before, from snapshot_sources
+    #with limited (the first pass stopped at --limit), only the sources of that pass are watched
+    #a burst of events is handled once it has been quiet for debounce seconds
+    watched = set(snapshot) if limited else None
+    folders = watched_folders(script_dir)
+    watcher = make_watcher(folders, poll_interval)
+    print(f"Watching {len(folders)} folders for changes, press Ctrl+C to stop.")
+    try:
+        while stop is None or not stop.is_set():
+            if not watcher.wait(1.0):
+                continue
+            while watcher.wait(debounce):
+                pass
+
+            known_steam_libraries.cache_clear()
+            new_snapshot = {}
+            for _ in snapshot_sources(filter_sources(discover_sources(script_dir), name_filter), new_snapshot):
+                pass
+            if watched is not None:
+                new_snapshot = {path: entry for path, entry in new_snapshot.items() if path in watched}
+            changed, removed = diff_snapshots(snapshot, new_snapshot)
+            for base_name in removed:
+                print(f"Removed {prune_outputs(output_folder, base_name)} outputs of {base_name}")
+            if changed:
+                process(changed)
+            snapshot = new_snapshot
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+
+#how many discovered sources may wait for a worker while the scan goes on
+DISCOVERY_QUEUE_SIZE = 64
+
+#settings kept between runs, next to the script
+SETTINGS_FILE = "white_icon_maker.ini"
+SETTINGS_SECTION = "settings"
+
+def load_settings(path):
+    #the saved settings as strings, {} when there are none yet
+    parser = ConfigParser(interpolation=None)
+    try:
+        parser.read(path, encoding='utf-8')
+    except Exception as e:
+        print(f"Ignoring unreadable settings file {path}: {e}")
+        return {}
+    return dict(parser[SETTINGS_SECTION]) if parser.has_section(SETTINGS_SECTION) else {}
+
+def save_settings(path, settings):
+    #merges settings (None values are left alone) into the settings file
+    parser = ConfigParser(interpolation=None)
+    with contextlib.suppress(Exception):
+        parser.read(path, encoding='utf-8')
+    if not parser.has_section(SETTINGS_SECTION):
+        parser.add_section(SETTINGS_SECTION)
+    for name, value in settings.items():
+        if value is not None:
+            parser[SETTINGS_SECTION][name] = str(value)
+    text = io.StringIO()
+    parser.write(text)
+    write_atomic(path, text.getvalue().encode('utf-8'))
+
+def main(workers=None, max_in_flight=None, use_cache=True, cache_size=DEFAULT_CACHE_SIZE,
+         timings=False, trace_path=None, profile_dir=None, bundle_path=None, name_filter=None, limit=None,
+         variants=None, ranking=None, watch=False, sources=None, output_folder=None, store_extractions=False):
+    #with watch, keeps running after the first batch and processes sources as they are added or changed
+    #with store_extractions, extracted icons are kept in the cache too so unchanged programs are not read again
+    #sources replaces the desktop and Steam scan with a list of (base_name, source_path)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    output_folder = output_folder or os.path.join(script_dir, "Processed_Icons")
+    os.makedirs(output_folder, exist_ok=True)
+    cache_dir = os.path.join(script_dir, CACHE_FOLDER) if use_cache else None
+    #never the scratch folder run_batch uses without a cache, that one is gone after the run
+    store_dir = cache_dir if store_extractions else None
+
+    if timings or trace_path or profile_dir:
+        enable_instrumentation(trace_path, profile_dir, summary=timings)
+
+    def process(sources):
+        summary = run_batch(sources, output_folder, workers=workers, max_in_flight=max_in_flight,
+                            cache_dir=cache_dir, bundle_path=bundle_path, variants=variants, ranking=ranking,
+                            store_dir=store_dir)
+
+        if cache_dir:
+            evicted = evict_icon_cache(cache_dir, cache_size)
+            if evicted:
+                print(f"Evicted {evicted} old entries from the icon cache.")
+
+        for names in summary["identical"]:
+            print(f"Identical icons, processed once: {', '.join(names)}")
+        for names in summary["similar"]:
+            print(f"Similar icons: {', '.join(names)}")
+        print(f"{summary['processed']} processed ({summary['duplicates']} duplicates reused), "
+              f"{summary['skipped']} skipped, {summary['failed']} failed out of {summary['total']} icons.")
+        if summary["processed"] and bundle_path:
+            print(f"Processing complete. Check {bundle_path}.")
+        elif summary["processed"]:
+            print(f"Processing complete. Check the '{os.path.basename(output_folder)}' folder.")
+        else:
+            print("No icons were processed.")
+
+    snapshot = {}
+    if sources is None:
+        sources = discover_sources(script_dir)
+    sources = filter_sources(sources, name_filter, limit)
+    process(prefetch(snapshot_sources(sources, snapshot), DISCOVERY_QUEUE_SIZE))
+    if watch:
+        watch_sources(script_dir, output_folder, process, snapshot, name_filter, limited=limit is not None)
+
+def show_icon_cache(cache_dir, max_bytes):
+    entries = icon_cache_entries(cache_dir)
+    icons = sum(1 for _, _, path in entries if os.path.isdir(path))
+    total = sum(size for _, size, _ in entries)
+    print(f"{cache_dir}: {icons} processed icons and {len(entries) - icons} stored extractions, "
+          f"{total / (1024 * 1024):.1f} of {max_bytes / (1024 * 1024):.0f} MB used.")
+
+#the command used when none is given, so the options of earlier versions keep working
+DEFAULT_COMMAND = "scan"
+
+def cli(argv=None):
+    #heavy modules (numpy, OpenCV, PIL, pywin32) are imported lazily by the stages that need them,
+    #so help, cache and single icon runs start quickly
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(description="Creates white icons from desktop shortcuts and Steam games.",
+                                     epilog=f"Without a command, '{DEFAULT_COMMAND}' is run. Use COMMAND --help for its options.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    #options of every command that processes icons
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--variants", metavar="NAMES",
+                        help=f"comma separated versions to make per icon, 'all' or any of: {', '.join(VARIANTS)} "
+                             f"(the white_ prefix may be left out)")
+    common.add_argument("--top", type=int, default=None, metavar="K",
+                        help="only save the K best scoring versions of each icon")
+    common.add_argument("--min-score", type=float, default=None, metavar="S",
+                        help="stop making versions once --top K of them (default 1) score at least S, from 0 to 1")
+    common.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU for scan, 1 for process; "
+                             "1 disables the pool)")
+    common.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of icons queued at once (default: twice the workers)")
+    common.add_argument("--cache", action=argparse.BooleanOptionalAction, default=None,
+                        help="reuse cached results, --no-cache reprocesses every icon (default: on)")
+    common.add_argument("--cache-size", type=int, default=None,
+                        help=f"maximum size of the icon cache in MB (default: {DEFAULT_CACHE_SIZE // (1024 * 1024)})")
+    common.add_argument("--store-extractions", action=argparse.BooleanOptionalAction, default=None,
+                        help="also keep the icons extracted from programs in the cache, so unchanged programs "
+                             "are not read again (default: off)")
+    common.add_argument("--save-settings", action="store_true",
+                        help=f"remember the options above in {SETTINGS_FILE} for later runs")
+    common.add_argument("--timings", action="store_true",
+                        help="print how long each processing stage took per icon")
+    common.add_argument("--trace", metavar="FILE",
+                        help="append per-icon stage timings and variant pixel counts to FILE as JSON lines")
+    common.add_argument("--profile", metavar="DIR",
+                        help="write a cProfile .prof file per icon to DIR")
+    settings_epilog = (f"--variants, --top, --min-score, --workers, --max-in-flight, --cache, --cache-size and "
+                       f"--store-extractions fall back to the values stored in {SETTINGS_FILE} by --save-settings.")
+
+    scan = commands.add_parser("scan", parents=[common], epilog=settings_epilog,
+                               help="process every shortcut next to the script and every Steam game (default)",
+                               description="Processes every shortcut next to the script and every Steam game "
+                                           "into the 'Processed_Icons' folder.")
+    scan.add_argument("--filter", metavar="PATTERN",
+                      help="only process icons whose name matches the glob PATTERN, e.g. 'steam*'")
+    scan.add_argument("--limit", type=int, default=None,
+                      help="stop after the first N icons found")
+    scan.add_argument("--bundle", metavar="ZIP",
+                      help="write every icon into the zip archive ZIP instead of the 'Processed_Icons' folder")
+    scan.add_argument("--watch", action="store_true",
+                      help="keep running and process shortcuts and games as they are added or changed")
+    #kept from before the cache command existed
+    scan.add_argument("--invalidate-cache", action="store_true", help=argparse.SUPPRESS)
+
+    process = commands.add_parser("process", parents=[common], epilog=settings_epilog,
+                                  help="process the given files only",
+                                  description="Processes the given shortcuts, programs, icons or images "
+                                              "(.png and friends work on any platform).")
+    process.add_argument("files", nargs="+", metavar="FILE")
+    process.add_argument("-o", "--output", metavar="DIR",
+                         help="folder to write the icons to (default: the 'Processed_Icons' folder)")
+
+    #listed for the help only, benchmarks.py parses its own options
+    commands.add_parser("bench", add_help=False, help="time the image processing stages, see bench --help")
+
+    cache = commands.add_parser("cache", help="show or clear the icon cache",
+                                description="Shows how much of the icon cache is used.")
+    cache.add_argument("--clear", action="store_true", help="delete every cached result")
+
+    if not argv or (argv[0].startswith("-") and argv[0] not in ("-h", "--help")):
+        argv.insert(0, DEFAULT_COMMAND)
+    if argv[0] == "bench":
+        import benchmarks
+        return benchmarks.main(argv[1:])
+    args = parser.parse_args(argv)
+    command = commands.choices[args.command]
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    settings_path = os.path.join(script_dir, SETTINGS_FILE)
+    cache_dir = os.path.join(script_dir, CACHE_FOLDER)
+
+    settings = load_settings(settings_path)
+    if args.command == "cache":
+        try:
+            cache_size = int(settings.get("cache_size") or DEFAULT_CACHE_SIZE // (1024 * 1024))
+        except ValueError as e:
+            command.error(f"invalid setting: {e}")
+        if args.clear:
+            print(f"Removed {invalidate_icon_cache(cache_dir)} cached icons.")
+        else:
+            show_icon_cache(cache_dir, cache_size * 1024 * 1024)
+        return
+
+    if args.command == "scan" and args.watch and args.bundle:
+        command.error("--watch writes to the 'Processed_Icons' folder and cannot be combined with --bundle")
+    if args.command == "process":
+        missing = [path for path in args.files if not os.path.isfile(path)]
+        if missing:
+            command.error(f"no such file: {', '.join(missing)}")
+
+    options = {
+        "variants": args.variants,
+        "top": args.top,
+        "min_score": args.min_score,
+        "workers": args.workers,
+        "max_in_flight": args.max_in_flight,
+        "cache": None if args.cache is None else ("yes" if args.cache else "no"),
+        "cache_size": args.cache_size,
+        "store_extractions": None if args.store_extractions is None else ("yes" if args.store_extractions else "no"),
+    }
+    settings.update({name: str(value) for name, value in options.items() if value is not None})
+
+    try:
+        variants = parse_variants(settings.get("variants"))
+        top_k = int(settings["top"]) if settings.get("top") else None
+        min_score = float(settings["min_score"]) if settings.get("min_score") else None
+        ranking = (top_k, min_score) if top_k or min_score is not None else None
+        workers = int(settings["workers"]) if settings.get("workers") else None
+        max_in_flight = int(settings["max_in_flight"]) if settings.get("max_in_flight") else None
+        use_cache = ConfigParser.BOOLEAN_STATES[settings.get("cache", "yes").lower()]
+        cache_size = int(settings.get("cache_size") or DEFAULT_CACHE_SIZE // (1024 * 1024))
+        store_extractions = ConfigParser.BOOLEAN_STATES[settings.get("store_extractions", "no").lower()]
+    except (KeyError, ValueError) as e:
+        command.error(f"invalid setting: {e}")
+    if args.save_settings:
+        save_settings(settings_path, options)
+
+    options = dict(workers=workers, max_in_flight=max_in_flight, use_cache=use_cache,
+                   cache_size=cache_size * 1024 * 1024, timings=args.timings, trace_path=args.trace,
+                   profile_dir=args.profile, variants=variants, ranking=ranking,
+                   store_extractions=store_extractions)
+    if args.command == "process":
+        #a handful of files is done before a pool of worker processes would have started,
+        #so unless --workers or a saved setting asks for one
+        options["workers"] = workers or 1
+        sources = [(os.path.splitext(os.path.basename(path))[0], os.path.abspath(path)) for path in args.files]
+        main(sources=sources, output_folder=args.output, **options)
+    elif args.invalidate_cache:
+        print(f"Removed {invalidate_icon_cache(cache_dir)} cached icons.")
+    else:
+        main(bundle_path=args.bundle, name_filter=args.filter, limit=args.limit, watch=args.watch, **options)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,221 @@
+#benchmarks for the image processing stages of app_icon.py
+#runs headless on any platform, only numpy, PIL and cv2 are needed
+#usage: python benchmarks.py [--sizes 32,256] [--output results.json] [--compare old_results.json] [--startup]
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+import PIL
+from PIL import Image
+
+import app_icon
+
+
+SIZES = (16, 32, 48, 64, 128, 256)
+KINDS = ('pixel_art', 'gradient', 'dense', 'two_tone')
+
+def make_icon(kind, size, seed=0):
+    #deterministic synthetic icon of one of the KINDS, transparent corners like real icons
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / max(size - 1, 1)
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+
+    if kind == 'pixel_art':
+        #8x8 grid of palette colours scaled up with hard edges
+        palette = rng.integers(0, 256, (6, 3), dtype=np.uint8)
+        cells = rng.integers(0, len(palette), (8, 8))
+        cell = np.minimum((np.mgrid[0:size, 0:size] * 8) // size, 7)
+        rgba[:, :, :3] = palette[cells[cell[0], cell[1]]]
+    elif kind == 'gradient':
+        rgba[:, :, 0] = x * 255
+        rgba[:, :, 1] = y * 255
+        rgba[:, :, 2] = (1 - x) * 255
+    elif kind == 'dense':
+        #noisy high frequency colour
+        rgba[:, :, :3] = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    elif kind == 'two_tone':
+        stripes = ((x + y) * 6).astype(int) % 2 == 0
+        rgba[:, :, :3] = np.where(stripes[:, :, None], (20, 20, 30), (230, 220, 200))
+    else:
+        raise ValueError(f"unknown icon kind {kind}")
+
+    #rounded silhouette with a soft edge
+    distance = np.hypot(x - 0.5, y - 0.5)
+    rgba[:, :, 3] = np.clip((0.48 - distance) * size * 64, 0, 255).astype(np.uint8)
+    return Image.fromarray(rgba, "RGBA")
+
+def white_mask(img):
+    #the white_original variation, input of the artifact removal stages
+    return dict(app_icon.render_threshold_variations(img, [("white_original", [[]])]))["white_original"]
+
+def stage_functions(reference=False):
+    #(name, setup, run) for every stage, setup builds the stage input outside of the timing
+    stages = [
+        ("threshold_variations", lambda img: img, lambda img: list(app_icon.render_threshold_variations(img))),
+        ("remove_artifacts", white_mask, app_icon.remove_artifacts),
+        ("enhanced_remove_artifacts", white_mask, app_icon.enhanced_remove_artifacts),
+        ("characteristic_variations", lambda img: img,
+         lambda img: app_icon.create_characteristic_variations(img=img, base_name="bench", output_folder=OUTPUT_DIR)),
+        ("edge_preprocess", lambda img: img, app_icon.preprocess_edges),
+        ("form_coherent_lines_thick", app_icon.preprocess_edges,
+         lambda planes: app_icon.form_coherent_lines_thick(None, planes)),
+        ("form_coherent_lines_curved", app_icon.preprocess_edges,
+         lambda planes: app_icon.form_coherent_lines_curved(None, planes)),
+        ("create_transparency_from_edges", lambda img: img, app_icon.create_transparency_from_edges),
+        ("extract_edges_and_fill", lambda img: img, app_icon.extract_edges_and_fill),
+        ("extract_edges_and_lines", lambda img: img, app_icon.extract_edges_and_lines),
+        ("process_icon", lambda img: img, lambda img: app_icon.process_icon(img, "bench", OUTPUT_DIR)),
+    ]
+    if reference:
+        stages.insert(2, ("remove_artifacts_reference", white_mask, app_icon.remove_artifacts_reference))
+        stages.insert(4, ("enhanced_remove_artifacts_reference", white_mask, app_icon.enhanced_remove_artifacts_reference))
+    return stages
+
+#stages that write files put them here, it is replaced by a temporary folder in run_benchmarks
+OUTPUT_DIR = tempfile.gettempdir()
+
+def measure(run, data, repeat):
+    #best and median wall time over repeat runs after a warm-up run, then peak traced memory of one extra run
+    run(data)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(data)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), statistics.median(times), peak
+
+def run_benchmarks(sizes=SIZES, kinds=KINDS, stages=None, repeat=3, reference=False):
+    #returns the results document, one entry per stage, icon kind and size
+    global OUTPUT_DIR
+    selected = [s for s in stage_functions(reference) if not stages or s[0] in stages]
+    results = []
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        OUTPUT_DIR = output_dir
+        for name, setup, run in selected:
+            for kind in kinds:
+                for size in sizes:
+                    data = setup(make_icon(kind, size))
+                    try:
+                        #the stages print progress, keep the report readable
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            best, median, peak = measure(run, data, repeat)
+                    except Exception as e:
+                        results.append({"stage": name, "kind": kind, "size": size, "error": str(e)})
+                        print(f"{name:38} {kind:10} {size:4}px failed: {e}")
+                        continue
+                    results.append({
+                        "stage": name,
+                        "kind": kind,
+                        "size": size,
+                        "seconds": best,
+                        "median_seconds": median,
+                        "pixels_per_sec": size * size / best if best else None,
+                        "peak_bytes": peak,
+                    })
+                    print(f"{name:38} {kind:10} {size:4}px {best * 1000:10.2f} ms "
+                          f"{size * size / best / 1e6 if best else 0:9.2f} Mpx/s {peak / 1024:10.1f} KiB")
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "pillow": PIL.__version__,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def measure_startup(repeat=3):
+    #wall time of a fresh interpreter running app_icon.py commands, what a single icon run pays
+    #before any work is done (imports included), best and median of repeat runs
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_icon.py")
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        icon_path = os.path.join(folder, "startup.png")
+        make_icon("pixel_art", 256).save(icon_path)
+        commands = [
+            ("help", ["--help"]),
+            ("cache", ["cache"]),
+            ("process", ["process", icon_path, "--output", folder, "--no-cache"]),
+        ]
+        for name, args in commands:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, script] + args, stdout=subprocess.DEVNULL, check=True)
+                times.append(time.perf_counter() - start)
+            results.append({"command": name, "seconds": min(times), "median_seconds": statistics.median(times)})
+            print(f"startup {name:30} {min(times) * 1000:10.2f} ms")
+    return results
+
+def compare_results(current, previous):
+    #prints the speedup of every stage/kind/size present in both documents
+    old = {(r["stage"], r["kind"], r["size"]): r for r in previous["results"]}
+    print(f"\n{'stage':38} {'kind':10} {'size':>6} {'before':>12} {'after':>12} {'speedup':>8}")
+    for r in current["results"]:
+        before = old.get((r["stage"], r["kind"], r["size"]))
+        if before and before.get("seconds") and r.get("seconds"):
+            print(f"{r['stage']:38} {r['kind']:10} {r['size']:4}px {before['seconds'] * 1000:9.2f} ms "
+                  f"{r['seconds'] * 1000:9.2f} ms {before['seconds'] / r['seconds']:7.2f}x")
+    old = {r["command"]: r for r in previous.get("startup", [])}
+    for r in current.get("startup", []):
+        before = old.get(r["command"])
+        if before:
+            print(f"{'startup ' + r['command']:38} {'':10} {'':6} {before['seconds'] * 1000:9.2f} ms "
+                  f"{r['seconds'] * 1000:9.2f} ms {before['seconds'] / r['seconds']:7.2f}x")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the image processing stages of app_icon.py.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated icon sizes")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="comma separated icon kinds")
+    parser.add_argument("--stages", default="", help="comma separated stage names (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    parser.add_argument("--reference", action="store_true",
+                        help="also time the slow pure Python reference implementations")
+    parser.add_argument("--output", default="bench_results.json", help="where to save the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--startup", action="store_true",
+                        help="also time cold starts of app_icon.py commands in fresh interpreters")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        sizes=[int(s) for s in args.sizes.split(",") if s],
+        kinds=[k for k in args.kinds.split(",") if k],
+        stages=[s for s in args.stages.split(",") if s],
+        repeat=args.repeat,
+        reference=args.reference,
+    )
+    if args.startup:
+        results["startup"] = measure_startup(args.repeat)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_results(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
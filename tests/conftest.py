@@ -0,0 +1,5 @@
+#the tests import app_icon and benchmarks from the folder above
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+#the vectorized artifact removal against the original per-pixel implementations
+import numpy as np
+import pytest
+from PIL import Image
+
+import app_icon
+
+
+def random_mask(seed, size=(37, 29), density=0.35):
+    #scattered white pixels and small clusters on transparent, with a few coloured and half transparent ones
+    rng = np.random.default_rng(seed)
+    width, height = size
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    visible = rng.random((height, width)) < density
+    pixels[visible] = (255, 255, 255, 255)
+    coloured = visible & (rng.random((height, width)) < 0.1)
+    pixels[coloured, :3] = rng.integers(0, 256, (int(coloured.sum()), 3))
+    faint = visible & (rng.random((height, width)) < 0.1)
+    pixels[faint, 3] = rng.integers(1, 255, int(faint.sum()))
+    return Image.fromarray(pixels, "RGBA")
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("min_cluster_size", [1, 5, 12])
+def test_enhanced_remove_artifacts_matches_reference(seed, min_cluster_size):
+    image = random_mask(seed)
+    expected = app_icon.enhanced_remove_artifacts_reference(image, min_cluster_size)
+    assert app_icon.enhanced_remove_artifacts(image, min_cluster_size).tobytes() == expected.tobytes()
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("density", [0.05, 0.35, 0.8])
+def test_remove_artifacts_matches_reference(seed, density):
+    image = random_mask(seed, density=density)
+    expected = app_icon.remove_artifacts_reference(image)
+    assert app_icon.remove_artifacts(image).tobytes() == expected.tobytes()
+
+def test_cluster_area_histogram():
+    pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+    pixels[0, 0] = pixels[0, 7] = (255, 255, 255, 255)
+    pixels[4:6, 2:5] = (255, 255, 255, 128)
+    image = Image.fromarray(pixels, "RGBA")
+    assert app_icon.cluster_area_histogram(image) == {1: 2, 6: 1}
+
+def test_enhanced_remove_artifacts_debug_prints_the_histogram(capsys):
+    pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+    pixels[0, 0] = (255, 255, 255, 255)
+    pixels[4:6, 2:5] = (255, 255, 255, 255)
+    app_icon.enhanced_remove_artifacts(Image.fromarray(pixels, "RGBA"), min_cluster_size=5, debug=True)
+    assert "Cluster areas: 1px x1, 6px x1 (removing 1 below 5px)" in capsys.readouterr().out
+
+def test_remove_artifacts_batch_matches_reference():
+    images = [random_mask(seed, density=0.2) for seed in range(6)]
+    cleaned = app_icon.remove_artifacts_batch(np.stack([np.asarray(image) for image in images]))
+    for image, result in zip(images, cleaned):
+        assert result.tobytes() == app_icon.remove_artifacts_reference(image).tobytes()
@@ -0,0 +1,197 @@
+#reading icons straight from .ico files and PE resources, without win32
+import io
+import os
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app_icon
+
+
+def make_image(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size, size, 4), dtype=np.uint8), "RGBA")
+
+def icon_image_data(image):
+    #the PNG entry data PIL writes for a one-size .ico
+    buffer = io.BytesIO()
+    image.save(buffer, format="ICO", sizes=[image.size])
+    data = buffer.getvalue()
+    size, offset = struct.unpack_from('<II', data, 6 + 8)
+    return data[offset:offset + size]
+
+def paletted_dib(size, seed=0):
+    #(8 bit DIB entry with its AND mask, the RGBA image it stands for)
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+    indices = rng.integers(0, 256, (size, size), dtype=np.uint8)
+    transparent = rng.random((size, size)) < 0.3
+    header = struct.pack('<IiiHHIIiiII', 40, size, size * 2, 1, 8, 0, 0, 0, 0, 256, 0)
+    colours = np.concatenate([palette[:, ::-1], np.zeros((256, 1), np.uint8)], axis=1).tobytes()
+    #rows are stored bottom up, each padded to 4 bytes
+    xor = np.pad(indices[::-1], [(0, 0), (0, -size % 4)]).tobytes()
+    mask_rows = np.packbits(transparent[::-1], axis=1)
+    mask = np.pad(mask_rows, [(0, 0), (0, -mask_rows.shape[1] % 4)]).tobytes()
+    rgba = np.concatenate([palette[indices], np.where(transparent, 0, 255)[..., None].astype(np.uint8)], axis=2)
+    return header + colours + xor + mask, rgba
+
+def build_pe(resources):
+    #minimal PE32+ image with a single .rsrc section, resources is {type_id: [(id_or_name, data)]}
+    section_rva, section_file = 0x1000, 0x200
+    types = sorted(resources)
+    #named entries come first, then ids ascending, like a linker writes them
+    items = {t: sorted(resources[t], key=lambda r: (isinstance(r[0], int), r[0])) for t in types}
+
+    offset = 16 + 8 * len(types)
+    type_dirs = {}
+    for t in types:
+        type_dirs[t] = offset
+        offset += 16 + 8 * len(items[t])
+    language_dirs = {}
+    for t in types:
+        for i in range(len(items[t])):
+            language_dirs[t, i] = offset
+            offset += 16 + 8
+    data_entries = {}
+    for key in language_dirs:
+        data_entries[key] = offset
+        offset += 16
+    names = {}
+    for t in types:
+        for i, (name, _) in enumerate(items[t]):
+            if isinstance(name, str):
+                names[t, i] = offset
+                offset += 2 + 2 * len(name)
+    offset = (offset + 3) & ~3
+    blobs = {}
+    for t in types:
+        for i, (_, data) in enumerate(items[t]):
+            blobs[t, i] = offset
+            offset += (len(data) + 3) & ~3
+
+    rsrc = bytearray(offset)
+    def directory(at, entries):
+        named = sum(1 for name, _ in entries if name & 0x80000000)
+        struct.pack_into('<IIHHHH', rsrc, at, 0, 0, 0, 0, named, len(entries) - named)
+        for i, entry in enumerate(entries):
+            struct.pack_into('<II', rsrc, at + 16 + 8 * i, *entry)
+
+    directory(0, [(t, 0x80000000 | type_dirs[t]) for t in types])
+    for t in types:
+        directory(type_dirs[t], [(0x80000000 | names[t, i] if isinstance(name, str) else name,
+                                  0x80000000 | language_dirs[t, i]) for i, (name, _) in enumerate(items[t])])
+        for i, (name, data) in enumerate(items[t]):
+            directory(language_dirs[t, i], [(1033, data_entries[t, i])])
+            struct.pack_into('<IIII', rsrc, data_entries[t, i], section_rva + blobs[t, i], len(data), 0, 0)
+            if isinstance(name, str):
+                struct.pack_into('<H', rsrc, names[t, i], len(name))
+                rsrc[names[t, i] + 2:names[t, i] + 2 + 2 * len(name)] = name.encode('utf-16-le')
+            rsrc[blobs[t, i]:blobs[t, i] + len(data)] = data
+
+    pe_offset = 0x40
+    optional_size = 112 + 16 * 8
+    image = bytearray(section_file)
+    image[:2] = b'MZ'
+    struct.pack_into('<I', image, 0x3C, pe_offset)
+    image[pe_offset:pe_offset + 4] = b'PE\0\0'
+    struct.pack_into('<HHIIIHH', image, pe_offset + 4, 0x8664, 1, 0, 0, 0, optional_size, 0x22)
+    optional = pe_offset + 24
+    struct.pack_into('<H', image, optional, 0x20B)
+    struct.pack_into('<I', image, optional + 108, 16)
+    struct.pack_into('<II', image, optional + 112 + 2 * 8, section_rva, len(rsrc))
+    section = optional + optional_size
+    image[section:section + 8] = b'.rsrc\0\0\0'
+    struct.pack_into('<IIII', image, section + 8, len(rsrc), section_rva, len(rsrc), section_file)
+    return bytes(image) + bytes(rsrc)
+
+def icon_group(entries):
+    #RT_GROUP_ICON data for [(width, height, bit_count, icon_id, data)]
+    group = struct.pack('<HHH', 0, 1, len(entries))
+    for width, height, bit_count, icon_id, data in entries:
+        group += struct.pack('<BBBBHHIH', width % 256, height % 256, 0, 0, 1, bit_count, len(data), icon_id)
+    return group
+
+@pytest.fixture
+def program(tmp_path):
+    #a program with a named icon group (listed first) and group 7, which holds a 256 px PNG, a 32 px PNG
+    #and a 32 px 8 bit BMP of another image
+    images = {'big': make_image(256, 1), 'small': make_image(32, 2), 'main': make_image(48, 4)}
+    data = {name: icon_image_data(img) for name, img in images.items()}
+    data['bmp'], images['bmp'] = paletted_dib(32, 3)
+    resources = {
+        app_icon.RT_ICON: [(1, data['main']), (2, data['big']), (3, data['small']), (4, data['bmp'])],
+        app_icon.RT_GROUP_ICON: [
+            (7, icon_group([(256, 256, 32, 2, data['big']), (32, 32, 32, 3, data['small']),
+                            (32, 32, 8, 4, data['bmp'])])),
+            ("MAINICON", icon_group([(48, 48, 32, 1, data['main'])])),
+        ],
+    }
+    path = tmp_path / "program.exe"
+    path.write_bytes(build_pe(resources))
+    return str(path), images, data
+
+def test_read_pe_resources_lists_named_groups_first(program):
+    path, _, _ = program
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert [name for name, _ in app_icon.read_pe_resources(data, app_icon.RT_GROUP_ICON)] == ["MAINICON", 7]
+    assert [name for name, _ in app_icon.read_pe_resources(data, app_icon.RT_ICON)] == [1, 2, 3, 4]
+
+def test_read_pe_resources_rejects_other_files():
+    with pytest.raises(ValueError):
+        app_icon.read_pe_resources(b'\x89PNG' + bytes(100), app_icon.RT_ICON)
+
+def test_read_icon_entries_follows_extract_icon_ex_indexes(program):
+    path, _, data = program
+    assert app_icon.read_icon_entries(path, 0) == [(48, 48, 32, data['main'])]
+    assert [entry[:3] for entry in app_icon.read_icon_entries(path, 1)] == [(256, 256, 32), (32, 32, 32), (32, 32, 8)]
+    assert app_icon.read_icon_entries(path, -7) == app_icon.read_icon_entries(path, 1)
+    assert app_icon.read_icon_entries(path, 2) == []
+    assert app_icon.read_icon_entries(path, -8) == []
+
+def test_extract_icons_keeps_the_deepest_image_per_size(program):
+    path, images, _ = program
+    extracted = app_icon.extract_icons(path, 1)
+    assert [img.size for img in extracted] == [(256, 256), (32, 32)]
+    assert extracted[0].tobytes() == images['big'].tobytes()
+    assert extracted[1].tobytes() == images['small'].tobytes()
+
+def test_bmp_entries_are_decoded_with_their_mask(program):
+    _, images, data = program
+    decoded = np.asarray(app_icon.decode_icon_entry(32, 32, 8, data['bmp']))
+    expected = images['bmp']
+    assert np.array_equal(decoded[..., 3], expected[..., 3])
+    opaque = expected[..., 3] > 0
+    assert np.array_equal(decoded[opaque], expected[opaque])
+
+def test_read_icon_entries_of_an_ico_file(tmp_path):
+    image = make_image(64, 5)
+    path = tmp_path / "icon.ico"
+    image.save(path, format="ICO", sizes=[(64, 64), (16, 16)])
+    assert sorted(entry[:2] for entry in app_icon.read_icon_entries(str(path))) == [(16, 16), (64, 64)]
+    assert app_icon.extract_icons(str(path))[0].tobytes() == image.tobytes()
+
+def launcher_path():
+    #a real Windows program with an icon, the script launchers that come with pip
+    try:
+        from pip._vendor import distlib
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(distlib.__file__), "w64.exe")
+    return path if os.path.exists(path) else None
+
+@pytest.mark.skipif(launcher_path() is None, reason="pip's Windows launchers are not installed")
+def test_icons_of_a_real_program():
+    extracted = app_icon.extract_icons(launcher_path())
+    assert extracted
+    sizes = [img.size for img in extracted]
+    assert sizes == sorted(sizes, key=lambda s: s[0] * s[1], reverse=True)
+
+def test_encode_ico_keeps_the_aspect_ratio(tmp_path):
+    wide = make_image(64, 6).resize((300, 100))
+    path = tmp_path / "wide.ico"
+    path.write_bytes(app_icon.encode_ico(wide, [wide.size]))
+    sizes = [entry[:2] for entry in app_icon.read_icon_entries(str(path))]
+    assert sizes == [(64, 21), (48, 16), (32, 11), (24, 8), (16, 5)]
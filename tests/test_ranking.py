@@ -0,0 +1,31 @@
+#ranking of the variants of one icon (--top / --min-score)
+import contextlib
+import io
+
+import pytest
+from PIL import Image
+
+import app_icon
+from benchmarks import KINDS, make_icon, white_mask
+
+
+@pytest.mark.parametrize("size", [32, 64, 128, 256])
+@pytest.mark.parametrize("kind", KINDS)
+def test_silhouette_is_not_the_top_pick(kind, size):
+    img = make_icon(kind, size)
+    writer = app_icon.IcoWriter(collect=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        kept = app_icon.process_icon(img, kind, "out", writer=writer, ranking=(1, None))
+    files = writer.flush()
+    assert len(kept) == 1
+    best = Image.open(io.BytesIO(files[kept[0]]))
+    assert not app_icon.score_variant(best, app_icon.ranking_planes(img))['silhouette']
+
+def test_identical_variants_are_kept_once():
+    img = make_icon('two_tone', 64)
+    writer = app_icon.IcoWriter(collect=True)
+    ranking = app_icon.RankingWriter(writer, img, top_k=2)
+    mask = white_mask(img)
+    ranking.add("a_white_original.ico", mask)
+    ranking.add("a_white_no_black.ico", mask.copy())
+    assert list(ranking.finish()) == ["a_white_original.ico"]
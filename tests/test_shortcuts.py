@@ -0,0 +1,122 @@
+#reading .lnk and .url shortcuts without COM
+import struct
+
+import pytest
+
+import app_icon
+
+
+def counted_string(text):
+    #a unicode StringData entry, its length in characters followed by UTF-16 text
+    return struct.pack('<H', len(text)) + text.encode('utf-16-le')
+
+def build_lnk(flags=0, icon_index=0, link_info=b'', strings=(), blocks=()):
+    #header, LinkInfo, StringData in flag order and extra data blocks closed by the terminal block
+    flags |= app_icon.LNK_IS_UNICODE | (app_icon.LNK_HAS_LINK_INFO if link_info else 0)
+    header = struct.pack('<I16sI', 0x4C, app_icon.LNK_CLSID, flags)
+    header += bytes(0x38 - len(header)) + struct.pack('<i', icon_index)
+    header += bytes(0x4C - len(header))
+    return header + link_info + b''.join(counted_string(s) for s in strings) + b''.join(blocks) + bytes(4)
+
+def link_info(info_flags, body, local_base=0, network_link=0, suffix=0, unicode_offsets=None):
+    #LinkInfo with its offsets relative to the start of the structure, body follows the header
+    header_size = 0x24 if unicode_offsets else 0x1C
+    fields = [0, header_size, info_flags, 0, local_base, network_link, suffix]
+    if unicode_offsets:
+        fields += list(unicode_offsets)
+    fields[0] = header_size + len(body)
+    return struct.pack(f'<{len(fields)}I', *fields) + body
+
+def local_link_info(base, suffix=''):
+    #ANSI local base path and common path suffix
+    base_data = base.encode('cp1252') + b'\0'
+    return link_info(0x1, base_data + suffix.encode('cp1252') + b'\0',
+                     local_base=0x1C, suffix=0x1C + len(base_data))
+
+def environment_block(signature, value):
+    #EnvironmentVariableDataBlock: 260 ANSI bytes then 520 UTF-16 bytes
+    ansi = value.encode('cp1252').ljust(260, b'\0')
+    unicode = value.encode('utf-16-le').ljust(520, b'\0')
+    return struct.pack('<II', 0x314, signature) + ansi + unicode
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_parse_lnk_local_path(tmp_path):
+    path = write(tmp_path, "game.lnk", build_lnk(icon_index=3, link_info=local_link_info("C:\\Games\\", "game.exe")))
+    assert app_icon.parse_lnk(path) == ("C:\\Games\\game.exe", "", 3)
+
+def test_parse_lnk_unicode_local_path(tmp_path):
+    base = "C:\\Spiele\\Café\\".encode('utf-16-le') + bytes(2)
+    suffix = "spiel.exe".encode('utf-16-le') + bytes(2)
+    body = b'\0' + b'\0' + base + suffix
+    info = link_info(0x1, body, local_base=0x24, suffix=0x25, unicode_offsets=(0x26, 0x26 + len(base)))
+    path = write(tmp_path, "spiel.lnk", build_lnk(link_info=info))
+    assert app_icon.parse_lnk(path)[0] == "C:\\Spiele\\Café\\spiel.exe"
+
+@pytest.mark.parametrize("unicode", [False, True])
+def test_parse_lnk_network_path(tmp_path, unicode):
+    if unicode:
+        net_name = "\\\\server\\share".encode('utf-16-le') + bytes(2)
+        link = struct.pack('<5I2I', 0x1C + len(net_name), 0, 0x1C, 0, 0, 0x1C, 0) + net_name
+    else:
+        net_name = b"\\\\server\\share\0"
+        link = struct.pack('<5I', 0x14 + len(net_name), 0, 0x14, 0, 0) + net_name
+    suffix = b"tools\\app.exe\0"
+    info = link_info(0x2, link + suffix, network_link=0x1C, suffix=0x1C + len(link))
+    path = write(tmp_path, "app.lnk", build_lnk(link_info=info))
+    assert app_icon.parse_lnk(path)[0] == "\\\\server\\share\\tools\\app.exe"
+
+def test_parse_lnk_icon_location_and_negative_index(tmp_path):
+    data = build_lnk(flags=0x40, icon_index=-101, link_info=local_link_info("C:\\app.exe"),
+                     strings=["C:\\icons\\app.dll"])
+    path = write(tmp_path, "app.lnk", data)
+    assert app_icon.parse_lnk(path) == ("C:\\app.exe", "C:\\icons\\app.dll", -101)
+
+def test_parse_lnk_icon_environment_block(tmp_path, monkeypatch):
+    monkeypatch.setenv("ICON_TEST_ROOT", "D:\\Programs")
+    block = environment_block(app_icon.LNK_ICON_ENVIRONMENT_BLOCK, "%ICON_TEST_ROOT%\\app\\app.ico")
+    data = build_lnk(flags=0x40 | app_icon.LNK_HAS_EXP_ICON, icon_index=2, link_info=local_link_info("C:\\app.exe"),
+                     strings=["C:\\stale\\app.ico"], blocks=[block])
+    path = write(tmp_path, "app.lnk", data)
+    assert app_icon.parse_lnk(path) == ("C:\\app.exe", "D:\\Programs\\app\\app.ico", 2)
+
+def test_parse_lnk_environment_target_and_relative_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("TARGET_TEST_ROOT", "E:\\Apps")
+    block = environment_block(app_icon.LNK_ENVIRONMENT_BLOCK, "%TARGET_TEST_ROOT%\\tool.exe")
+    path = write(tmp_path, "tool.lnk", build_lnk(blocks=[block]))
+    assert app_icon.parse_lnk(path)[0] == "E:\\Apps\\tool.exe"
+
+    path = write(tmp_path, "relative.lnk", build_lnk(flags=0x8, strings=["bin/tool.exe"]))
+    assert app_icon.parse_lnk(path)[0] == str(tmp_path / "bin" / "tool.exe")
+
+def test_parse_lnk_rejects_other_files(tmp_path):
+    with pytest.raises(ValueError):
+        app_icon.parse_lnk(write(tmp_path, "fake.lnk", b"[InternetShortcut]\r\n" + bytes(0x4C)))
+
+def test_parse_url_shortcut(tmp_path):
+    path = write(tmp_path, "game.url", b"[InternetShortcut]\r\nURL=steam://rungameid/440\r\n"
+                                       b"IconFile=C:\\Steam\\steam\\games\\tf2.ico\r\nIconIndex=1\r\n")
+    assert app_icon.parse_url_shortcut(path) == ("steam://rungameid/440", "C:\\Steam\\steam\\games\\tf2.ico", 1)
+
+def test_parse_url_shortcut_rejects_other_files(tmp_path):
+    with pytest.raises(ValueError):
+        app_icon.parse_url_shortcut(write(tmp_path, "notes.url", b"[Notes]\r\nURL=https://example.com\r\n"))
+
+def test_steam_url_without_icon_uses_the_game_executable(tmp_path, monkeypatch):
+    library = tmp_path / "library"
+    game_dir = library / "steamapps" / "common" / "Team Fortress 2"
+    game_dir.mkdir(parents=True)
+    (game_dir / "_CommonRedist").mkdir()
+    (game_dir / "_CommonRedist" / "vcredist_x64.exe").write_bytes(b"MZ")
+    (game_dir / "tf.exe").write_bytes(b"MZ")
+    (library / "steamapps" / "appmanifest_440.acf").write_text(
+        '"AppState"\n{\n\t"appid"\t\t"440"\n\t"name"\t\t"Team Fortress 2"\n\t"installdir"\t\t"Team Fortress 2"\n}\n')
+    monkeypatch.setattr(app_icon, "known_steam_libraries", lambda: (str(library),))
+
+    path = write(tmp_path, "tf2.url", b"[InternetShortcut]\r\nURL=steam://rungameid/440\r\n"
+                                      b"IconFile=C:\\missing\\tf2.ico\r\nIconIndex=4\r\n")
+    executable = str(game_dir / "tf.exe")
+    assert app_icon.resolve_shortcut(path) == (executable, executable, 0)